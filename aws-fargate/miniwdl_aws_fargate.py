@@ -6,9 +6,14 @@ import contextlib
 import pathlib
 import shutil
 import random
-from typing import Callable, Set, Dict, Optional
+import threading
+import atexit
+import itertools
+import heapq
+from typing import Any, Callable, Set, Dict, List, Optional
 
 import psutil
+import botocore.exceptions
 from aegea import ecs
 
 from WDL._util import chmod_R_plus, PygtailLogger
@@ -17,6 +22,375 @@ from WDL.runtime.task_container import TaskContainer
 from WDL.runtime.error import Interrupted, Terminated
 
 
+_THROTTLING_ERROR_CODES = {"ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException"}
+
+
+def is_throttling(exn: Exception) -> bool:
+    return (
+        isinstance(exn, botocore.exceptions.ClientError)
+        and exn.response.get("Error", {}).get("Code") in _THROTTLING_ERROR_CODES
+    )
+
+
+class TaskPoller:
+    """
+    Polls the status of all running ECS tasks on one thread, describing up to 100 tasks per
+    describe_tasks request, and publishes their descriptions to the waiting containers. The poll
+    interval grows with the number of requests needed per round (to stay under describe_tasks_per_s)
+    and backs off exponentially while ECS throttles the requests. A task that DescribeTasks keeps
+    reporting as a failure (e.g. MISSING) for max_failed_polls rounds in a row is published as
+    STOPPED with stopCode DescribeTasksFailed, so that its waiters give up on it.
+    """
+    max_tasks_per_request = 100
+    # (tolerating a few, as a just-launched task may be MISSING until ECS is consistent)
+    max_failed_polls = 3
+
+    def __init__(self, cfg: config.Loader, logger: logging.Logger) -> None:
+        self.logger = logger
+        self.min_interval = 1.0
+        if cfg.has_option("aws_fargate", "poll_interval_s"):
+            self.min_interval = cfg["aws_fargate"].get_float("poll_interval_s")
+        self.max_interval = 30.0
+        if cfg.has_option("aws_fargate", "max_poll_interval_s"):
+            self.max_interval = cfg["aws_fargate"].get_float("max_poll_interval_s")
+        self.requests_per_s = 5.0
+        if cfg.has_option("aws_fargate", "describe_tasks_per_s"):
+            self.requests_per_s = cfg["aws_fargate"].get_float("describe_tasks_per_s")
+        self.interval = self.min_interval
+        self._cond = threading.Condition()
+        self._tasks: Dict[str, dict] = {}  # taskArn => latest description
+        self._failed_polls: Dict[str, int] = {}  # taskArn => consecutive DescribeTasks failures
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, task_desc: dict) -> None:
+        with self._cond:
+            self._tasks[task_desc["taskArn"]] = task_desc
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_forever, name="ecs_task_poller", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def unwatch(self, task_arn: str) -> None:
+        with self._cond:
+            self._tasks.pop(task_arn, None)
+            self._failed_polls.pop(task_arn, None)
+
+    def describe(self, task_arn: str) -> dict:
+        with self._cond:
+            return self._tasks[task_arn]
+
+    def wait(self, task_arn: str, last_status: Optional[str], timeout: float) -> dict:
+        """
+        Wait up to timeout for the task's status to differ from last_status, then return its latest
+        description
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._tasks[task_arn].get("lastStatus") != last_status, timeout)
+            return self._tasks[task_arn]
+
+    def _poll_forever(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._tasks)
+                clusters: Dict[str, List[str]] = {}
+                for task_arn, task_desc in self._tasks.items():
+                    clusters.setdefault(task_desc["clusterArn"], []).append(task_arn)
+            requests, throttled = self._poll(clusters)
+            if throttled:
+                self.interval = min(self.interval * 2, self.max_interval)
+                self.logger.warning("ECS DescribeTasks throttled, polling every %.1fs", self.interval)
+            else:
+                floor = max(self.min_interval, requests / self.requests_per_s)
+                self.interval = max(floor, self.interval * 0.75)
+            time.sleep(self.interval)
+
+    def _poll(self, clusters: Dict[str, List[str]]):
+        requests = 0
+        for cluster, task_arns in clusters.items():
+            for i in range(0, len(task_arns), self.max_tasks_per_request):
+                try:
+                    res = ecs.clients.ecs.describe_tasks(
+                        cluster=cluster, tasks=task_arns[i:i + self.max_tasks_per_request]
+                    )
+                except Exception as exn:
+                    if is_throttling(exn):
+                        return requests, True
+                    self.logger.warning("ECS DescribeTasks failed: %s", exn)
+                    continue
+                requests += 1
+                with self._cond:
+                    for task_desc in res["tasks"]:
+                        if task_desc["taskArn"] in self._tasks:
+                            self._tasks[task_desc["taskArn"]] = task_desc
+                            self._failed_polls.pop(task_desc["taskArn"], None)
+                    for failure in res.get("failures", []):
+                        self._fail(failure)
+                    self._cond.notify_all()
+        return requests, False
+
+    def _fail(self, failure: dict) -> None:
+        # (with lock held)
+        task_arn = failure.get("arn")
+        if task_arn not in self._tasks or self._tasks[task_arn].get("lastStatus") == "STOPPED":
+            return
+        self._failed_polls[task_arn] = self._failed_polls.get(task_arn, 0) + 1
+        if self._failed_polls[task_arn] >= self.max_failed_polls:
+            reason = " ".join(str(failure[k]) for k in ("reason", "detail") if failure.get(k))
+            self.logger.warning("ECS DescribeTasks failed for task %s: %s", task_arn, reason)
+            self._tasks[task_arn] = dict(
+                self._tasks[task_arn],
+                lastStatus="STOPPED",
+                stopCode="DescribeTasksFailed",
+                stoppedReason=f"ECS DescribeTasks failed: {reason}",
+            )
+
+
+class LaunchScheduler:
+    """
+    Paces ECS RunTask requests from all the task threads through a token bucket (run_tasks_per_s,
+    with bursts up to run_task_burst), serving waiting launches in the order they first asked. A
+    launch failing because RunTask is throttled or Fargate capacity is short is retried after a
+    jittered exponential backoff, keeping its place in line, up to max_launch_attempts; throttling
+    also empties the bucket, holding back the other launches. Time spent waiting is logged for each
+    launch and summarized at exit.
+    """
+
+    def __init__(self, cfg: config.Loader, logger: logging.Logger) -> None:
+        self.logger = logger
+        self.rate = 10.0
+        if cfg.has_option("aws_fargate", "run_tasks_per_s"):
+            self.rate = cfg["aws_fargate"].get_float("run_tasks_per_s")
+        self.burst = 20.0
+        if cfg.has_option("aws_fargate", "run_task_burst"):
+            self.burst = cfg["aws_fargate"].get_float("run_task_burst")
+        self.max_attempts = 8
+        if cfg.has_option("aws_fargate", "max_launch_attempts"):
+            self.max_attempts = cfg["aws_fargate"].get_int("max_launch_attempts")
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled = time.time()
+        self._waiting: List[int] = []  # heap of the waiting launches' sequence numbers
+        self._seq = itertools.count()
+        self.stats = {"launches": 0, "retries": 0, "failures": 0, "wait_s": 0.0, "max_wait_s": 0.0}
+        atexit.register(self.log_stats)
+
+    def launch(self, logger: logging.Logger, run_task: Callable[[], Any]) -> Any:
+        """
+        Call run_task() once the launch's turn comes, retrying it as needed; returns its result
+        """
+        seq = next(self._seq)
+        t0 = time.time()
+        wait_s = 0.0
+        attempt = 0
+        while True:
+            t1 = time.time()
+            self._take_turn(seq)
+            wait_s += time.time() - t1
+            attempt += 1
+            try:
+                rslt = run_task()
+            except Exception as exn:
+                if attempt >= self.max_attempts or not (is_throttling(exn) or self.is_capacity_error(exn)):
+                    self._record(wait_s, attempt - 1, failed=True)
+                    raise
+                if is_throttling(exn):
+                    with self._cond:
+                        self._tokens = 0.0
+                delay = random.uniform(0, min(60.0, 2.0 ** attempt))
+                logger.warning("RunTask failed (%s), retrying in %.1fs (attempt %d)", exn, delay, attempt)
+                time.sleep(delay)
+                wait_s += delay
+                continue
+            self._record(wait_s, attempt - 1)
+            logger.info(
+                "RunTask after %.1fs waiting in launch queue, %.1fs total (attempts: %d)",
+                wait_s, time.time() - t0, attempt,
+            )
+            return rslt
+
+    @staticmethod
+    def is_capacity_error(exn: Exception) -> bool:
+        # Fargate reports insufficient capacity as RunTask failures (surfacing from aegea.ecs.run as
+        # an exception), or a ClientError with this message
+        return "capacity is unavailable" in str(exn).lower() or "insufficient capacity" in str(exn).lower()
+
+    def _take_turn(self, seq: int) -> None:
+        with self._cond:
+            heapq.heappush(self._waiting, seq)
+            while True:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                if self._waiting[0] == seq and self._tokens >= 1.0:
+                    break
+                self._cond.wait(None if self._waiting[0] != seq else (1.0 - self._tokens) / self.rate)
+            heapq.heappop(self._waiting)
+            self._tokens -= 1.0
+            self._cond.notify_all()
+
+    def _record(self, wait_s: float, retries: int, failed: bool = False) -> None:
+        with self._cond:
+            self.stats["launches"] += 1
+            self.stats["retries"] += retries
+            self.stats["failures"] += int(failed)
+            self.stats["wait_s"] += wait_s
+            self.stats["max_wait_s"] = max(self.stats["max_wait_s"], wait_s)
+
+    def log_stats(self) -> None:
+        if self.stats["launches"]:
+            self.logger.info(
+                "RunTask launches: %d, retries: %d, failures: %d, mean queue wait %.1fs, max %.1fs",
+                self.stats["launches"], self.stats["retries"], self.stats["failures"],
+                self.stats["wait_s"] / self.stats["launches"], self.stats["max_wait_s"],
+            )
+
+
+class Worker:
+    """
+    A long-lived Fargate task running WDL task commands one at a time. Its directory on EFS holds a
+    "job" file, naming the EFS subdirectory of the task to run, and an "exit_code" file, written by
+    the worker when the command finishes.
+    """
+
+    def __init__(self, worker_id: str, key: tuple, host_dir: str) -> None:
+        self.worker_id = worker_id
+        self.key = key
+        self.host_dir = host_dir
+        self.task_desc: Optional[dict] = None
+        self.jobs = 0
+        self.idle_since = time.time()
+
+    @property
+    def task_arn(self) -> str:
+        assert self.task_desc is not None
+        return self.task_desc["taskArn"]
+
+    def assign(self, efs_subdir: str) -> None:
+        job_file = os.path.join(self.host_dir, "job")
+        with open(job_file + ".tmp", "w") as outfile:
+            outfile.write(efs_subdir)
+        os.rename(job_file + ".tmp", job_file)
+        self.jobs += 1
+
+    def exit_code(self) -> Optional[int]:
+        exit_code_file = os.path.join(self.host_dir, "exit_code")
+        try:
+            with open(exit_code_file) as infile:
+                exit_code = int(infile.read().strip())
+        except FileNotFoundError:
+            return None
+        os.unlink(exit_code_file)
+        return exit_code
+
+
+class WorkerPool:
+    """
+    Warm Fargate workers, keyed by (image, cpu, memory), reused across WDL tasks. A task takes an idle
+    worker with its key, or else launches a new one; the worker returns to the pool after the task,
+    or is stopped if the task failed in a way that leaves it in doubt. Workers idle for longer than
+    idle_timeout are stopped. The workers also exit by themselves after twice that long without a
+    job, in case miniwdl itself dies.
+    """
+
+    def __init__(self, cfg: config.Loader, logger: logging.Logger, task_poller: TaskPoller) -> None:
+        self.logger = logger
+        self.task_poller = task_poller
+        self.idle_timeout = 300.0
+        if cfg.has_option("aws_fargate", "worker_idle_timeout_s"):
+            self.idle_timeout = cfg["aws_fargate"].get_float("worker_idle_timeout_s")
+        self._lock = threading.Lock()
+        self._idle: Dict[tuple, List[Worker]] = {}
+        self._workers: Dict[str, Worker] = {}
+        self._ids = itertools.count()
+        self._reaper: Optional[threading.Thread] = None
+        atexit.register(self.shutdown)
+
+    def acquire(
+        self, logger: logging.Logger, key: tuple, workers_dir: str, launch: Callable[[Worker], dict]
+    ) -> Worker:
+        """
+        Take an idle worker with the key, or else launch one, using launch(worker) to run its
+        Fargate task (the worker directory under workers_dir is created first)
+        """
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_forever, name="fargate_worker_reaper", daemon=True)
+                self._reaper.start()
+            while self._idle.get(key):
+                worker = self._idle[key].pop()
+                if self.task_poller.describe(worker.task_arn)["lastStatus"] in AWSFargateContainer.stopping_states:
+                    self._discard(worker)
+                    continue
+                logger.info("Reusing Fargate worker %s (jobs: %d)", worker.task_arn, worker.jobs)
+                return worker
+            worker_id = f"{os.getpid()}_{next(self._ids)}"
+            worker = Worker(worker_id, key, os.path.join(workers_dir, worker_id))
+            self._workers[worker_id] = worker
+        os.makedirs(worker.host_dir)
+        try:
+            worker.task_desc = launch(worker)
+        except Exception:
+            with self._lock:
+                self._discard(worker)
+            raise
+        self.task_poller.watch(worker.task_desc)
+        logger.info("Launched Fargate worker %s", worker.task_arn)
+        return worker
+
+    def release(self, worker: Worker, reusable: bool) -> None:
+        with self._lock:
+            if reusable:
+                worker.idle_since = time.time()
+                self._idle.setdefault(worker.key, []).append(worker)
+                return
+            task_arns = self._retire(worker)
+        self._stop(task_arns)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            task_arns = [arn for worker in list(self._workers.values()) for arn in self._retire(worker)]
+        self._stop(task_arns)
+
+    def reap(self) -> None:
+        "stop workers idle for longer than idle_timeout"
+        task_arns = []
+        with self._lock:
+            for workers in self._idle.values():
+                for worker in [w for w in workers if time.time() - w.idle_since > self.idle_timeout]:
+                    workers.remove(worker)
+                    self.logger.info("Stopping idle Fargate worker %s", worker.task_arn)
+                    task_arns += self._retire(worker)
+        self._stop(task_arns)
+
+    def _reap_forever(self) -> None:
+        while True:
+            time.sleep(max(1.0, min(self.idle_timeout / 4, 60.0)))
+            self.reap()
+
+    def _retire(self, worker: Worker) -> List[str]:
+        # (with lock held) discard the worker, returning its task ARN if the task still needs stopping
+        task_arns = []
+        if worker.task_desc and self.task_poller.describe(worker.task_arn)["lastStatus"] != "STOPPED":
+            task_arns.append(worker.task_arn)
+        self._discard(worker)
+        return task_arns
+
+    def _stop(self, task_arns: List[str]) -> None:
+        # (without lock held, since each is an ECS API call)
+        for task_arn in task_arns:
+            try:
+                ecs.stop(ecs.stop_parser.parse_args([task_arn]))
+            except Exception:
+                self.logger.exception("failed to stop Fargate worker")
+
+    def _discard(self, worker: Worker) -> None:
+        # (with lock held)
+        self._workers.pop(worker.worker_id, None)
+        if worker.task_desc:
+            self.task_poller.unwatch(worker.task_arn)
+        shutil.rmtree(worker.host_dir, ignore_errors=True)
+
+
 class AWSFargateContainer(TaskContainer):
     fargate_mem_values = [512] + list(range(1024, 30721, 1024))
     fargate_cpu_values = [256, 512, 1024, 2048, 4096]
@@ -33,11 +407,22 @@ class AWSFargateContainer(TaskContainer):
     }
     running_states = {"PROVISIONING", "PENDING", "ACTIVATING", "RUNNING"}
     stopping_states = {"DEACTIVATING", "STOPPING", "DEPROVISIONING", "STOPPED"}
+    # stop codes of tasks that won't report an exit code (DescribeTasksFailed is TaskPoller's own)
+    failed_stop_codes = {"TaskFailedToStart", "DescribeTasksFailed"}
     default_efs_security_group = "aegea.efs"
     _observed_states: Optional[Set[str]] = None
+    task_poller: TaskPoller
+    launch_scheduler: LaunchScheduler
+    worker_pool: Optional[WorkerPool] = None
+    # where workers mount the EFS filesystem root
+    worker_efs_dir = "/mnt/miniwdl_efs"
 
     @classmethod
     def global_init(cls, cfg: config.Loader, logger: logging.Logger) -> None:
+        cls.task_poller = TaskPoller(cfg, logger)
+        cls.launch_scheduler = LaunchScheduler(cfg, logger)
+        if cfg.has_option("aws_fargate", "worker_pool") and cfg["aws_fargate"].get_bool("worker_pool"):
+            cls.worker_pool = WorkerPool(cfg, logger, cls.task_poller)
         try:
             cls.efs_security_group = cfg["aws_fargate"]["efs_security_group"]
         except config.ConfigMissing:
@@ -85,14 +470,14 @@ class AWSFargateContainer(TaskContainer):
         return cls._limits
 
     def poll_task(
-        self, logger: logging.Logger, task_desc, verbose: bool = False
+        self, logger: logging.Logger, task_desc, verbose: bool = False, timeout: float = 0
     ) -> Optional[int]:
-        res = ecs.clients.ecs.describe_tasks(cluster=task_desc["clusterArn"], tasks=[task_desc["taskArn"]])
-        task_desc = res["tasks"][0]
+        # wait for the task poller to report a status change (or the timeout)
+        task_desc = self.task_poller.wait(task_desc["taskArn"], task_desc.get("lastStatus"), timeout)
         if task_desc["lastStatus"] not in self._observed_states:  # type: ignore
             logger.info("Task %s %s", task_desc["taskArn"], task_desc["lastStatus"])
             self._observed_states.add(task_desc["lastStatus"])  # type: ignore
-        if task_desc["lastStatus"] == "STOPPED" and task_desc.get("stopCode") == "TaskFailedToStart":
+        if task_desc["lastStatus"] == "STOPPED" and task_desc.get("stopCode") in self.failed_stop_codes:
             raise Interrupted(task_desc.get("stoppedReason"))
         return task_desc.get("containers", [{}])[0].get("exitCode")
 
@@ -155,6 +540,14 @@ class AWSFargateContainer(TaskContainer):
             pathlib.Path(os.path.join(self.host_dir, pipe_file)).touch()
 
         efs_subdir = os.path.relpath(self.host_dir, self.efs_mountpoint)
+        if self.worker_pool is not None:
+            if user:
+                # (the worker must be able to link container_dir to each task's directory)
+                logger.info("Not using Fargate worker pool, since the task runs as user %s", user)
+            else:
+                key = (image_tag, fargate_cpu_value, fargate_mem_value)
+                return self._run_on_worker(logger, terminating, key, efs_subdir)
+
         run_args = [
             "--command", f"cd {wd} && bash ../command 2> >(tee -a ../stderr.txt 1>&2) > >(tee -a ../stdout.txt)",
             "--security-group", self.efs_security_group,
@@ -169,7 +562,8 @@ class AWSFargateContainer(TaskContainer):
 
         if user:
             run_args += ["--user", user]
-        task_desc = ecs.run(ecs.run_parser.parse_args(run_args))
+        task_desc = self.launch_scheduler.launch(logger, lambda: ecs.run(ecs.run_parser.parse_args(run_args)))
+        self.task_poller.watch(task_desc)
         exit_code = None
         try:
             with contextlib.ExitStack() as cleanup:
@@ -184,11 +578,13 @@ class AWSFargateContainer(TaskContainer):
                 # poll for task exit code
                 was_running = False
                 while exit_code is None:
-                    time.sleep(random.uniform(1.0, 2.0))  # spread out work over the GIL
                     if terminating():
                         self.poll_task(logger, task_desc, verbose=True)
                         raise Terminated(quiet=False)
-                    exit_code = self.poll_task(logger, task_desc)
+                    # wake up on status changes, and otherwise every so often to check for termination
+                    # and tail stderr (spread out over the GIL)
+                    exit_code = self.poll_task(logger, task_desc, timeout=random.uniform(1.0, 2.0))
+                    task_desc = self.task_poller.describe(task_desc["taskArn"])
                     if not was_running and self._observed_states.intersection(self.running_states):
                         cleanup.enter_context(
                             _statusbar.task_running(
@@ -203,9 +599,93 @@ class AWSFargateContainer(TaskContainer):
             assert isinstance(exit_code, int)
             return exit_code
         finally:
+            self.task_poller.unwatch(task_desc["taskArn"])
             if not self._observed_states.intersection(self.stopping_states):
                 try:
                     logger.info("Stopping task %s", task_desc["taskArn"])
                     ecs.stop(ecs.stop_parser.parse_args([task_desc["taskArn"]]))
                 except Exception:
                     logger.exception("failed to stop ECS task")
+
+    def _run_on_worker(self, logger: logging.Logger, terminating: Callable[[], bool], key: tuple,
+                       efs_subdir: str) -> int:
+        assert self.worker_pool is not None
+        self._observed_states = set()
+        worker = self.worker_pool.acquire(
+            logger,
+            key,
+            os.path.join(self.efs_mountpoint, ".miniwdl_workers"),  # type: ignore
+            lambda worker: self._launch_worker(logger, worker),
+        )
+        reusable = False
+        try:
+            with contextlib.ExitStack() as cleanup:
+                poll_stderr = cleanup.enter_context(
+                    PygtailLogger(
+                        logger,
+                        os.path.join(self.host_dir, "stderr.txt"),
+                        callback=self.stderr_callback,
+                    )
+                )
+                worker.assign(efs_subdir)
+                task_desc = self.task_poller.describe(worker.task_arn)
+
+                # poll for task exit code, written by the worker
+                was_running = False
+                exit_code = None
+                while exit_code is None:
+                    if terminating():
+                        raise Terminated(quiet=False)
+                    worker_exit_code = self.poll_task(logger, task_desc, timeout=random.uniform(1.0, 2.0))
+                    task_desc = self.task_poller.describe(task_desc["taskArn"])
+                    exit_code = worker.exit_code()
+                    if exit_code is None and worker_exit_code is not None:
+                        raise Interrupted(f"Fargate worker {task_desc['taskArn']} exited")
+                    if not was_running and "RUNNING" in self._observed_states:
+                        cleanup.enter_context(
+                            _statusbar.task_running(
+                                self.runtime_values.get("cpu", 0),
+                                self.runtime_values.get("memory_reservation", 0),
+                            )
+                        )
+                        was_running = True
+                    if was_running:
+                        poll_stderr()
+
+            reusable = True
+            return exit_code
+        finally:
+            self.worker_pool.release(worker, reusable)
+
+    def _launch_worker(self, logger: logging.Logger, worker: Worker) -> dict:
+        worker_dir = os.path.join(
+            self.worker_efs_dir, os.path.relpath(worker.host_dir, self.efs_mountpoint)  # type: ignore
+        )
+        idle_limit = int(2 * self.worker_pool.idle_timeout)  # type: ignore
+        # run each job in the task directory linked at container_dir, then write its exit code
+        script = f"""
+            idle=0
+            while [ $idle -lt {idle_limit} ]; do
+                if [ -f {worker_dir}/job ]; then
+                    ln -sfn "{self.worker_efs_dir}/$(cat {worker_dir}/job)" {self.container_dir} || exit 1
+                    rm {worker_dir}/job
+                    (cd {self.container_dir}/work &&
+                     bash ../command 2> >(tee -a ../stderr.txt 1>&2) > >(tee -a ../stdout.txt))
+                    echo $? > {worker_dir}/exit_code.tmp && mv {worker_dir}/exit_code.tmp {worker_dir}/exit_code
+                    idle=0
+                else
+                    sleep 1
+                    idle=$((idle + 1))
+                fi
+            done
+        """
+        image_tag, fargate_cpu_value, fargate_mem_value = worker.key
+        run_args = [
+            "--command", script,
+            "--security-group", self.efs_security_group,  # type: ignore
+            "--volumes", f"{self.efs_id}:/={self.worker_efs_dir}",  # type: ignore
+            "--image", image_tag,
+            "--fargate-memory", str(fargate_mem_value),
+            "--fargate-cpu", str(fargate_cpu_value)
+        ]
+        return self.launch_scheduler.launch(logger, lambda: ecs.run(ecs.run_parser.parse_args(run_args)))
@@ -0,0 +1,86 @@
+"""
+TaskPoller tests against a stand-in for the aegea ECS client (no AWS access needed):
+
+    python3 -m unittest discover -s aws-fargate/test
+"""
+import os
+import sys
+import types
+import logging
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import aegea.ecs  # noqa: F401
+except ImportError:
+    # only the names used at import time; the tests patch miniwdl_aws_fargate.ecs themselves
+    sys.modules["aegea"] = types.ModuleType("aegea")
+    sys.modules["aegea.ecs"] = sys.modules["aegea"].ecs = types.ModuleType("aegea.ecs")  # type: ignore
+
+import miniwdl_aws_fargate  # noqa: E402
+from WDL.runtime import config  # noqa: E402
+from WDL.runtime.error import Interrupted  # noqa: E402
+
+
+class FakeECSClient:
+    "describe_tasks reports the tasks in self.tasks, and the rest as MISSING"
+
+    def __init__(self):
+        self.tasks = {}
+
+    def describe_tasks(self, cluster, tasks):
+        return {
+            "tasks": [dict(self.tasks[arn]) for arn in tasks if arn in self.tasks],
+            "failures": [{"arn": arn, "reason": "MISSING"} for arn in tasks if arn not in self.tasks],
+        }
+
+
+class TestTaskPoller(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(self.id())
+        self.client = FakeECSClient()
+        patcher = unittest.mock.patch.object(
+            miniwdl_aws_fargate, "ecs", types.SimpleNamespace(clients=types.SimpleNamespace(ecs=self.client))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.poller = miniwdl_aws_fargate.TaskPoller(config.Loader(self.logger), self.logger)
+
+    def watch(self, task_arn):
+        # (without starting the polling thread; the tests call _poll themselves)
+        self.poller._tasks[task_arn] = {"taskArn": task_arn, "clusterArn": "c", "lastStatus": "PROVISIONING"}
+
+    def poll(self):
+        self.assertEqual(self.poller._poll({"c": list(self.poller._tasks.keys())}), (1, False))
+
+    def test_update(self):
+        self.watch("arn:task/1")
+        self.client.tasks["arn:task/1"] = {"taskArn": "arn:task/1", "clusterArn": "c", "lastStatus": "RUNNING"}
+        self.poll()
+        self.assertEqual(self.poller.wait("arn:task/1", "PROVISIONING", 0)["lastStatus"], "RUNNING")
+
+    def test_missing(self):
+        self.watch("arn:task/1")
+        self.watch("arn:task/2")
+        for _ in range(self.poller.max_failed_polls - 1):
+            self.poll()
+        # briefly MISSING, as ECS may report a just-launched task
+        self.assertEqual(self.poller.describe("arn:task/1")["lastStatus"], "PROVISIONING")
+        self.client.tasks["arn:task/2"] = {"taskArn": "arn:task/2", "clusterArn": "c", "lastStatus": "RUNNING"}
+        self.poll()
+        task_desc = self.poller.wait("arn:task/1", "PROVISIONING", 0)
+        self.assertEqual(task_desc["lastStatus"], "STOPPED")
+        self.assertIn("MISSING", task_desc["stoppedReason"])
+        self.assertEqual(self.poller.describe("arn:task/2")["lastStatus"], "RUNNING")
+
+        # the container gives up on it
+        container = miniwdl_aws_fargate.AWSFargateContainer.__new__(miniwdl_aws_fargate.AWSFargateContainer)
+        container.task_poller = self.poller
+        container._observed_states = set()
+        with self.assertRaises(Interrupted):
+            container.poll_task(self.logger, task_desc)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+WorkerPool tests against a stand-in for the aegea ECS client (no AWS access needed):
+
+    python3 -m unittest discover -s aws-fargate/test
+"""
+import os
+import sys
+import types
+import logging
+import tempfile
+import shutil
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import aegea.ecs  # noqa: F401
+except ImportError:
+    # only the names used at import time; the tests patch miniwdl_aws_fargate.ecs themselves
+    sys.modules["aegea"] = types.ModuleType("aegea")
+    sys.modules["aegea.ecs"] = sys.modules["aegea"].ecs = types.ModuleType("aegea.ecs")  # type: ignore
+
+import miniwdl_aws_fargate  # noqa: E402
+from WDL.runtime import config  # noqa: E402
+
+
+class FakeECS:
+    "stands in for aegea.ecs: stop() marks the task STOPPED, and checks the pool lock isn't held"
+
+    def __init__(self, pool_lock):
+        self.pool_lock = pool_lock
+        self.stopped = []
+        self.stop_parser = types.SimpleNamespace(parse_args=lambda argv: types.SimpleNamespace(task_arn=argv[0]))
+
+    def stop(self, args):
+        assert not self.pool_lock.locked(), "ecs.stop called with the worker pool lock held"
+        self.stopped.append(args.task_arn)
+
+
+class FakeTaskPoller:
+    def __init__(self):
+        self.tasks = {}
+
+    def watch(self, task_desc):
+        self.tasks[task_desc["taskArn"]] = task_desc
+
+    def unwatch(self, task_arn):
+        self.tasks.pop(task_arn, None)
+
+    def describe(self, task_arn):
+        return self.tasks[task_arn]
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(self.id())
+        self.workers_dir = tempfile.mkdtemp(prefix="miniwdl_worker_pool_test_")
+        self.addCleanup(shutil.rmtree, self.workers_dir, ignore_errors=True)
+        cfg = config.Loader(self.logger)
+        cfg.override({"aws_fargate": {"worker_idle_timeout_s": 3600}})
+        self.poller = FakeTaskPoller()
+        with unittest.mock.patch("atexit.register"):
+            self.pool = miniwdl_aws_fargate.WorkerPool(cfg, self.logger, self.poller)
+        self.ecs = FakeECS(self.pool._lock)
+        patcher = unittest.mock.patch.object(miniwdl_aws_fargate, "ecs", self.ecs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.launched = []
+
+    def launch(self, worker):
+        self.launched.append(worker.worker_id)
+        return {"taskArn": f"arn:task/{len(self.launched)}", "lastStatus": "PROVISIONING"}
+
+    def acquire(self, key=("ubuntu:18.04", 1024, 2048)):
+        return self.pool.acquire(self.logger, key, self.workers_dir, self.launch)
+
+    def test_acquire_reuse(self):
+        worker = self.acquire()
+        self.assertTrue(os.path.isdir(worker.host_dir))
+        self.assertEqual(self.poller.describe(worker.task_arn)["lastStatus"], "PROVISIONING")
+        self.pool.release(worker, reusable=True)
+        self.assertIs(self.acquire(), worker)
+        # busy, or a different key: launch another
+        other = self.acquire()
+        self.assertIsNot(other, worker)
+        self.assertIsNot(self.acquire(("ubuntu:20.04", 1024, 2048)), worker)
+        self.assertEqual(len(self.launched), 3)
+        self.assertEqual(self.ecs.stopped, [])
+
+    def test_skip_stopped(self):
+        worker = self.acquire()
+        self.pool.release(worker, reusable=True)
+        self.poller.tasks[worker.task_arn]["lastStatus"] = "STOPPED"
+        replacement = self.acquire()
+        self.assertIsNot(replacement, worker)
+        self.assertFalse(os.path.exists(worker.host_dir))
+        self.assertNotIn(worker.task_arn, self.poller.tasks)
+        self.assertEqual(self.ecs.stopped, [])
+
+    def test_release_unusable(self):
+        worker = self.acquire()
+        self.pool.release(worker, reusable=False)
+        self.assertEqual(self.ecs.stopped, [worker.task_arn])
+        self.assertFalse(os.path.exists(worker.host_dir))
+        self.assertIsNot(self.acquire(), worker)
+
+    def test_reap(self):
+        stale, fresh = self.acquire(), self.acquire()
+        self.pool.release(stale, reusable=True)
+        self.pool.release(fresh, reusable=True)
+        stale.idle_since -= 2 * self.pool.idle_timeout
+        self.pool.reap()
+        self.assertEqual(self.ecs.stopped, [stale.task_arn])
+        self.assertFalse(os.path.exists(stale.host_dir))
+        self.assertIs(self.acquire(), fresh)
+
+    def test_shutdown(self):
+        busy, idle, stopped = self.acquire(), self.acquire(), self.acquire()
+        self.pool.release(idle, reusable=True)
+        self.poller.tasks[stopped.task_arn]["lastStatus"] = "STOPPED"
+        self.pool.shutdown()
+        self.assertEqual(sorted(self.ecs.stopped), sorted([busy.task_arn, idle.task_arn]))
+        self.assertEqual(os.listdir(self.workers_dir), [])
+
+    def test_launch_failure(self):
+        def launch(worker):
+            raise RuntimeError("RunTask failed")
+
+        with self.assertRaises(RuntimeError):
+            self.pool.acquire(self.logger, ("ubuntu:18.04", 1024, 2048), self.workers_dir, launch)
+        self.assertEqual(os.listdir(self.workers_dir), [])
+        self.assertEqual(self.pool._workers, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,77 +4,422 @@ Requires s3parcp docker image tag supplied in miniwdl configuration, either via
 (section s3parcp, key docker_image) or environment variable MINIWDL__S3PARCP__DOCKER_IMAGE.
 Inherits AWS credentials from miniwdl's environment (as detected by boto3).
 
+With MINIWDL__S3PARCP__IN_PROCESS=true, downloads instead run inside the miniwdl process, without
+starting a container: parallel ranged GETs (MINIWDL__S3PARCP__IN_PROCESS_CONCURRENCY, default 8, of
+MINIWDL__S3PARCP__PART_SIZE_MB, default 16) written straight into the download cache's holding area,
+then verified against the object's checksum or ETag. If that fails for any reason, the download is
+retried through the s3parcp container. This applies only to downloads that miniwdl will move into
+its download cache ([download_cache] put = true); miniwdl would leave others in the holding area,
+outside its run directory, so they're always downloaded through the container. In-process downloads
+are resumable (unless MINIWDL__S3PARCP__RESUMABLE=false): the partial file and a journal of its
+completed pieces persist under the holding area, so that if miniwdl is killed midway, the next
+attempt fetches only the missing pieces (provided the object's ETag hasn't changed).
+
+Setting MINIWDL__S3PARCP__CACHE_DIR enables a local content cache of downloaded objects, keyed by
+bucket, key and ETag (checked by a HEAD request each time), shared by concurrent miniwdl processes
+on the host. Cache hits are hard-linked (or reflinked) to the download location instead of being
+fetched again; the least recently used entries are evicted to keep the cache under
+MINIWDL__S3PARCP__CACHE_MAX_GB (default 100). For hard links to work, the cache should be on the
+same filesystem as the miniwdl download cache.
+
+With MINIWDL__S3PARCP__BATCH_WINDOW_MS set, downloads through the container that start within that
+window of each other (e.g. a workflow's many s3:// inputs) are coalesced into one s3parcp_batch task,
+up to MINIWDL__S3PARCP__BATCH_MAX (default 32) URIs each, which downloads them concurrently.
+
+Before launching the container, the plugin HEADs the object and sizes the task's cpu, memory and
+s3parcp concurrency according to the first of MINIWDL__S3PARCP__RESOURCE_TIERS (a JSON list of
+{"max_gb", "cpu", "memory_gb", "concurrency"}, see DEFAULT_RESOURCE_TIERS) that fits the object, and
+sets AWS_REGION for s3parcp to the bucket's region.
+
+All downloads share one boto3 session, S3 clients for each region, a cache of each bucket's region
+(via GetBucketLocation), and one credentials file for the tasks, replaced only once botocore has
+refreshed the credentials.
+
+Directory inputs given as s3://bucket/prefix/ are handled too (by main_directory): in-process, under
+the same conditions as files, or else by miniwdl's built-in aws s3 cp task. In-process, the prefix
+is listed with parallel ListObjectsV2 calls, one per "subdirectory," and the objects are downloaded
+concurrently (MINIWDL__S3PARCP__DIRECTORY_CONCURRENCY, default 16) into a tree mirroring their keys.
+
 The plugin is installed using the "entry points" mechanism in setup.py. Furthermore, the miniwdl
 configuration [plugins] section has options to enable/disable installed plugins. Installed &
 enabled plugins can be observed using miniwdl --version and/or miniwdl run --debug.
 """
 
 import os
+import atexit
+import base64
+import errno
+import fcntl
+import hashlib
+import json
+import shutil
 import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from concurrent import futures
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
 import boto3
+import botocore.config
+import botocore.exceptions
+from WDL._util import StructuredLogMessage as _
+from WDL.runtime.cache import CallCache
+from WDL.runtime.download import awscli_directory_downloader
 
 
 def main(cfg, logger, uri, **kwargs):
-    # get AWS credentials from boto3
-    b3 = boto3.session.Session()
-    b3creds = b3.get_credentials()
-    aws_credentials = {
-        "AWS_ACCESS_KEY_ID": b3creds.access_key,
-        "AWS_SECRET_ACCESS_KEY": b3creds.secret_key,
-    }
-    if b3creds.token:
-        aws_credentials["AWS_SESSION_TOKEN"] = b3creds.token
+    # only downloads that miniwdl will move into its download cache can be placed in its holding
+    # area; others go through the container task, which miniwdl runs in the run directory
+    cacheable = download_cacheable(cfg, logger, uri)
+    cache = download_cache(cfg)
+    head = None
+    if cache and cacheable:
+        try:
+            head = head_object(uri)
+            filename = cache.get(logger, uri, head, new_download_dir(cfg))
+        except Exception as exn:
+            logger.warning(_("s3parcp download cache lookup failed", uri=uri, error=str(exn)))
+            cache = None
+        else:
+            if filename:
+                yield {"outputs": {"file": filename}}
+                return
 
-    # s3parcp (or perhaps underlying golang AWS lib) seems to require region set to match the
-    # bucket's; in contrast to awscli which can conveniently 'figure it out'
-    aws_credentials["AWS_REGION"] = b3.region_name if b3.region_name else "us-west-2"
+    if head is None and cfg["s3parcp"].get_bool("size_resources", True):
+        try:
+            head = head_object(uri)
+        except Exception as exn:
+            logger.warning(_("s3parcp HEAD failed; using default task resources", uri=uri, error=str(exn)))
 
-    # format them as env vars to be sourced in the WDL task command
-    aws_credentials = "\n".join(f"export {k}='{v}'" for (k, v) in aws_credentials.items())
+    if cfg["s3parcp"].get_bool("in_process", False) and cacheable:
+        try:
+            filename = download(cfg, logger, uri, head)
+        except Exception as exn:
+            logger.warning(
+                _("in-process download failed; retrying with s3parcp container", uri=uri, error=str(exn))
+            )
+        else:
+            if cache:
+                cache_put(logger, cache, uri, head, filename)
+            # no task needed; miniwdl takes the file as is
+            yield {"outputs": {"file": filename}}
+            return
 
-    # write them to a temp file that'll self-destruct automatically
-    temp_dir = "/mnt"
-    if cfg.has_option("s3parcp", "dir"):
-        temp_dir = cfg["s3parcp"]["dir"]
-    with tempfile.NamedTemporaryFile(
-        prefix="miniwdl_download_s3parcp_credentials_", delete=True, mode="w", dir=temp_dir
-    ) as aws_credentials_file:
-        print(aws_credentials, file=aws_credentials_file, flush=True)
-        # make file group-readable to ensure it'll be usable if the docker image runs as non-root
-        os.chmod(aws_credentials_file.name, os.stat(aws_credentials_file.name).st_mode | 0o40)
+    if cfg["s3parcp"].get_int("batch_window_ms", 0) > 0:
+        # coalesce with other s3 downloads starting around the same time into one task
+        batch, index = join_batch(cfg, uri, head, cacheable)
+        if index == 0:
+            filename = yield from run_batch(cfg, logger, batch)
+        else:
+            batch.done.wait()
+            filename = batch.files[index] if batch.files else None
+        if filename:
+            if cache and head:
+                cache_put(logger, cache, uri, head, filename, recheck=True)
+            yield {"outputs": {"file": filename}}
+            return
+        # no other URIs joined the batch, or else the batch failed, perhaps because of another URI;
+        # download this one on its own (only possible for the URIs besides the first, whose
+        # generator the failed batch task ended)
 
+    resources = task_resources(cfg, head["ContentLength"] if head else None)
+    with aws_credentials_file(cfg) as credentials:
         # yield WDL task and inputs (followed by outputs as well)
         recv = yield {
             "task_wdl": wdl,
-            "inputs": {
-                "uri": uri,
-                "aws_credentials": aws_credentials_file.name,
-                "docker": cfg["s3parcp"]["docker_image"],
-            },
+            "inputs": dict(
+                resources,
+                uri=uri,
+                aws_credentials=credentials,
+                region=task_region(logger, bucket_key(uri)[0]),
+                docker=cfg["s3parcp"]["docker_image"],
+            ),
         }
 
+    if cache and head:
+        # (s3parcp can't make the download conditional on the ETag, so recheck it afterwards; and
+        # without the HEAD from before, there's nothing to recheck against)
+        cache_put(logger, cache, uri, head, recv["outputs"]["file"], recheck=True)
+
     # yield task outputs (unchanged)
     yield recv
 
 
+class CredentialBroker:
+    """
+    process-wide AWS access for all the downloads: one boto3 session, whose credentials botocore
+    refreshes as they near expiry; S3 clients for each region; a cache of each bucket's region; and
+    a credentials file for the download tasks, reused until the credentials change
+    """
+
+    def __init__(self):
+        self.session = boto3.session.Session()
+        self._lock = threading.Lock()
+        self._clients: Dict[Optional[str], Any] = {}
+        self._regions: Dict[str, Optional[str]] = {}  # (None if the lookup failed)
+        # current credentials file & the credentials in it, and the number of tasks using each file
+        self._file: Optional[str] = None
+        self._file_credentials = None
+        self._file_refs: Dict[str, int] = {}
+        atexit.register(self._cleanup)
+
+    def client(self, region: Optional[str] = None):
+        with self._lock:
+            if region not in self._clients:
+                self._clients[region] = self.session.client(
+                    "s3",
+                    region_name=region,
+                    endpoint_url=os.getenv("AWS_ENDPOINT_URL"),
+                    config=botocore.config.Config(max_pool_connections=64, retries={"mode": "standard"}),
+                )
+            return self._clients[region]
+
+    def bucket_region(self, bucket: str) -> Optional[str]:
+        """
+        the bucket's region, from GetBucketLocation, or else HeadBucket (which reports the region
+        even when access is denied, as GetBucketLocation often is for others' buckets); None if
+        neither tells. Either way, the lookup isn't repeated.
+        """
+        with self._lock:
+            if bucket in self._regions:
+                return self._regions[bucket]
+        try:
+            location = self.client().get_bucket_location(Bucket=bucket)["LocationConstraint"]
+            # (legacy location constraints)
+            region = {None: "us-east-1", "": "us-east-1", "EU": "eu-west-1"}.get(location, location)
+        except botocore.exceptions.ClientError:
+            try:
+                rslt = self.client().head_bucket(Bucket=bucket)
+            except botocore.exceptions.ClientError as exn:
+                rslt = exn.response
+            region = rslt.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("x-amz-bucket-region")
+        with self._lock:
+            self._regions[bucket] = region or None
+        return region or None
+
+    @contextmanager
+    def credentials_file(self, temp_dir: str):
+        """
+        path to a file with the current credentials, as env vars to be sourced in the WDL task
+        command; the file is deleted once superseded and no longer in use
+        """
+        # refreshed by botocore, if near expiry
+        credentials = self.session.get_credentials().get_frozen_credentials()
+        with self._lock:
+            if self._file is None or self._file_credentials != credentials:
+                superseded = self._file
+                self._file = write_credentials_file(credentials, temp_dir)
+                self._file_credentials = credentials
+                self._file_refs[self._file] = 0
+                if superseded and not self._file_refs[superseded]:
+                    self._remove(superseded)
+            filename = self._file
+            self._file_refs[filename] += 1
+        try:
+            yield filename
+        finally:
+            with self._lock:
+                self._file_refs[filename] -= 1
+                if filename != self._file and not self._file_refs[filename]:
+                    self._remove(filename)
+
+    def _remove(self, filename: str) -> None:
+        # (with lock held)
+        del self._file_refs[filename]
+        try:
+            os.unlink(filename)
+        except FileNotFoundError:
+            pass
+
+    def _cleanup(self) -> None:
+        with self._lock:
+            for filename in list(self._file_refs.keys()):
+                self._remove(filename)
+
+
+def write_credentials_file(credentials, temp_dir: str) -> str:
+    aws_credentials = {
+        "AWS_ACCESS_KEY_ID": credentials.access_key,
+        "AWS_SECRET_ACCESS_KEY": credentials.secret_key,
+    }
+    if credentials.token:
+        aws_credentials["AWS_SESSION_TOKEN"] = credentials.token
+
+    # format them as env vars to be sourced in the WDL task command
+    fd, filename = tempfile.mkstemp(prefix="miniwdl_download_s3parcp_credentials_", dir=temp_dir)
+    with os.fdopen(fd, "w") as outfile:
+        for (k, v) in aws_credentials.items():
+            print(f"export {k}='{v}'", file=outfile)
+    # make file group-readable to ensure it'll be usable if the docker image runs as non-root
+    os.chmod(filename, os.stat(filename).st_mode | 0o40)
+    return filename
+
+
+_broker: Optional[CredentialBroker] = None
+_broker_lock = threading.Lock()
+
+
+def broker() -> CredentialBroker:
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = CredentialBroker()
+        return _broker
+
+
+def aws_credentials_file(cfg):
+    """
+    context manager for the path to the AWS credentials file, for the WDL task command to source
+    """
+    temp_dir = "/mnt"
+    if cfg.has_option("s3parcp", "dir"):
+        temp_dir = cfg["s3parcp"]["dir"]
+    return broker().credentials_file(temp_dir)
+
+
+def task_region(logger, bucket: str) -> str:
+    # s3parcp (or perhaps underlying golang AWS lib) seems to require region set to match the
+    # bucket's; in contrast to awscli which can conveniently 'figure it out'
+    try:
+        region = broker().bucket_region(bucket)
+    except Exception as exn:
+        logger.warning(_("couldn't determine S3 bucket region", bucket=bucket, error=str(exn)))
+        region = None
+    return region or broker().session.region_name or "us-west-2"
+
+
+class DownloadBatch:
+    """
+    URIs (all in one bucket, and all cacheable or not) to download together in one s3parcp_batch
+    task; the first to join runs the task, and the others wait for done. files is then the
+    downloaded file for each URI, or None if the task failed
+    """
+
+    def __init__(self, bucket: str, cacheable: bool):
+        self.bucket = bucket
+        self.cacheable = cacheable
+        self.uris: List[str] = []
+        self.sizes: List[Optional[int]] = []
+        self.closed = False
+        self.done = threading.Event()
+        self.files: Optional[List[str]] = None
+
+
+# open batch for each bucket (s3parcp needs AWS_REGION set to the bucket's) and cacheability (the
+# task runs in miniwdl's download cache holding area only if the first URI is cacheable, and
+# non-cacheable downloads must land in the run directory)
+_batches: Dict[Tuple[str, bool], DownloadBatch] = {}
+_batch_cond = threading.Condition()
+
+
+def join_batch(
+    cfg, uri: str, head: Optional[Dict[str, Any]] = None, cacheable: bool = False
+) -> Tuple[DownloadBatch, int]:
+    """
+    add uri to the open batch for its bucket & cacheability (opening a new one if needed),
+    returning the batch & its index therein
+    """
+    key = (bucket_key(uri)[0], cacheable)
+    with _batch_cond:
+        if key not in _batches or _batches[key].closed:
+            _batches[key] = DownloadBatch(*key)
+        batch = _batches[key]
+        batch.uris.append(uri)
+        batch.sizes.append(head["ContentLength"] if head else None)
+        if len(batch.uris) >= cfg["s3parcp"].get_int("batch_max", 32):
+            batch.closed = True
+            _batch_cond.notify_all()
+        return (batch, len(batch.uris) - 1)
+
+
+def run_batch(cfg, logger, batch: DownloadBatch):
+    """
+    (generator, for the first URI in the batch) wait out the batch window, then yield the task to
+    download all the batch's URIs and return the first one's file
+    """
+    try:
+        deadline = time.time() + cfg["s3parcp"].get_int("batch_window_ms", 0) / 1000
+        with _batch_cond:
+            while not batch.closed and time.time() < deadline:
+                _batch_cond.wait(deadline - time.time())
+            batch.closed = True
+            key = (batch.bucket, batch.cacheable)
+            if _batches.get(key) is batch:
+                del _batches[key]
+        if len(batch.uris) == 1:
+            # nothing to batch with; main() runs the regular task
+            return None
+        logger.info(_("s3parcp batch download", uris=len(batch.uris)))
+        # size the task for the batch's total size (if known)
+        known_sizes = [size for size in batch.sizes if size is not None]
+        resources = task_resources(cfg, sum(known_sizes) if len(known_sizes) == len(batch.sizes) else None)
+        with aws_credentials_file(cfg) as credentials:
+            recv = yield {
+                "task_wdl": wdl_batch,
+                "inputs": dict(
+                    resources,
+                    uris=batch.uris,
+                    aws_credentials=credentials,
+                    region=task_region(logger, batch.bucket),
+                    docker=cfg["s3parcp"]["docker_image"],
+                ),
+            }
+        files = recv["outputs"]["files"]
+        assert len(files) == len(batch.uris)
+        batch.files = files
+        return files[0]
+    finally:
+        # if the task failed, miniwdl closes the generator, failing the first URI's download; the
+        # other URIs then download on their own
+        batch.done.set()
+
+
+# cpu, memory & s3parcp concurrency for downloads up to each max_gb (the last tier has no limit)
+DEFAULT_RESOURCE_TIERS = [
+    {"max_gb": 0.1, "cpu": 1, "memory_gb": 1, "concurrency": 2},
+    {"max_gb": 10, "cpu": 4, "memory_gb": 4, "concurrency": 8},
+    {"cpu": 8, "memory_gb": 8, "concurrency": 32},
+]
+
+
+def task_resources(cfg, size: Optional[int]) -> Dict[str, int]:
+    """
+    task inputs cpu, memory_gb & concurrency for downloading size bytes, from the first of the
+    resource tiers it fits; none (the task's defaults) if the size is unknown
+    """
+    if size is None:
+        return {}
+    for tier in cfg["s3parcp"].get_list("resource_tiers", DEFAULT_RESOURCE_TIERS):
+        if tier.get("max_gb") is None or size <= tier["max_gb"] * 2**30:
+            return {k: int(tier[k]) for k in ("cpu", "memory_gb", "concurrency") if k in tier}
+    return {}
+
+
 # WDL task source code
 wdl = """
 task s3parcp {
     input {
         String uri
         File aws_credentials
+        String region
         String docker
 
         Int cpu = 4
+        Int memory_gb = cpu
+        # allocating one hardware thread to two concurrent part xfers
+        Int concurrency = cpu * 2
     }
 
     command <<<
         set -euo pipefail
         source "~{aws_credentials}"
+        export AWS_REGION="~{region}"
         mkdir __out
         cd __out
-        # allocating one hardware thread to two concurrent part xfers
-        s3parcp --checksum -c ~{cpu*2} "~{uri}" .
+        s3parcp --checksum -c ~{concurrency} "~{uri}" .
     >>>
 
     output {
@@ -83,8 +428,594 @@ task s3parcp {
 
     runtime {
         cpu: cpu
-        memory: "~{cpu}G"
+        memory: "~{memory_gb}G"
         docker: docker
     }
 }
 """
+
+
+wdl_batch = """
+task s3parcp_batch {
+    input {
+        Array[String] uris
+        File aws_credentials
+        String region
+        String docker
+
+        Int cpu = 4
+        Int memory_gb = cpu
+        Int concurrency = cpu * 2
+    }
+
+    # up to cpu concurrent downloads, sharing the part xfer concurrency
+    Int concurrency_each = (concurrency + cpu - 1) / cpu
+
+    command <<<
+        set -euo pipefail
+        source "~{aws_credentials}"
+        export AWS_REGION="~{region}"
+        mkdir __out
+        # "index uri" lines; each URI downloads into its own subdirectory, as basenames may collide
+        awk '{print NR-1 " " $0}' "~{write_lines(uris)}" > __uris.txt
+        download() {
+            set -euo pipefail
+            mkdir -p "__out/${1%% *}"
+            cd "__out/${1%% *}"
+            s3parcp --checksum -c ~{concurrency_each} "${1#* }" .
+        }
+        export -f download
+        xargs -d '\\n' -n 1 -P ~{cpu} bash -c 'download "$1"' _ < __uris.txt
+        while read -r i _uri; do
+            find "__out/$i" -mindepth 1 -maxdepth 1
+        done < __uris.txt > __files.txt
+    >>>
+
+    output {
+        Array[File] files = read_lines("__files.txt")
+    }
+
+    runtime {
+        cpu: cpu
+        memory: "~{memory_gb}G"
+        docker: docker
+    }
+}
+"""
+
+
+def s3_client(bucket: str):
+    """
+    S3 client for the bucket's region (avoiding redirects), or the default region if unknown
+    """
+    try:
+        region = broker().bucket_region(bucket)
+    except Exception:
+        region = None
+    return broker().client(region)
+
+
+def bucket_key(uri: str) -> Tuple[str, str]:
+    parsed = urlparse(uri)
+    bucket, key = parsed.hostname, parsed.path[1:]
+    assert bucket and key and not key.endswith("/"), f"invalid S3 object URI: {uri}"
+    return (bucket, key)
+
+
+def head_object(uri: str) -> Dict[str, Any]:
+    bucket, key = bucket_key(uri)
+    return s3_client(bucket).head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+
+
+def download_cacheable(cfg, logger, uri: str, directory: bool = False) -> bool:
+    """
+    whether miniwdl will move the download into its download cache, and hence accept it from
+    new_download_dir()
+    """
+    cache_path = CallCache(cfg, logger).download_cacheable(uri, directory=directory)
+    # (if the cache entry already exists, miniwdl was told not to use it, and keeps the download
+    # where it is)
+    return cache_path is not None and not os.path.exists(cache_path)
+
+
+def new_download_dir(cfg) -> str:
+    """
+    new directory under the download cache's holding area, whence miniwdl moves downloads into the
+    cache (only for download_cacheable() URIs!)
+    """
+    ops_dir = os.path.join(cfg["file_io"]["root"], cfg["download_cache"]["dir"], "ops")
+    os.makedirs(ops_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix="download-s3-", dir=ops_dir)
+
+
+def download(cfg, logger, uri: str, head: Optional[Dict[str, Any]] = None) -> str:
+    """
+    download the S3 object into a new download directory, returning the local filename
+    """
+    bucket, key = bucket_key(uri)
+    if cfg["s3parcp"].get_bool("resumable", True):
+        return download_resumable(cfg, logger, uri, head)
+    download_dir = new_download_dir(cfg)
+    filename = os.path.join(download_dir, os.path.basename(key))
+    try:
+        download_object(cfg, logger, bucket, key, filename, head)
+    except BaseException:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise
+    return filename
+
+
+def download_resumable(cfg, logger, uri: str, head: Optional[Dict[str, Any]] = None) -> str:
+    """
+    download into a partial file at a location determined by the URI, journaling the completed
+    pieces beside it, so that if this process is killed midway, the next attempt downloads only
+    the missing pieces. Once verified, the file moves into a new download directory.
+    """
+    bucket, key = bucket_key(uri)
+    ops_dir = os.path.join(cfg["file_io"]["root"], cfg["download_cache"]["dir"], "ops")
+    partial_dir = os.path.join(ops_dir, "partial", hashlib.sha256(uri.encode()).hexdigest())
+    os.makedirs(os.path.dirname(partial_dir), exist_ok=True)
+    # the lock file is beside partial_dir, not in it, so that it outlives the cleanup below; another
+    # process downloading the same URI goes first
+    with path_lock(partial_dir + ".lock"):
+        os.makedirs(partial_dir, exist_ok=True)
+        filename = os.path.join(partial_dir, os.path.basename(key))
+        try:
+            download_object(cfg, logger, bucket, key, filename, head, resumable=True)
+        except ChecksumMismatch:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        ans = os.path.join(new_download_dir(cfg), os.path.basename(key))
+        os.rename(filename, ans)
+        shutil.rmtree(partial_dir, ignore_errors=True)
+    return ans
+
+
+@contextmanager
+def path_lock(lock_path: str):
+    """
+    exclusive flock on the file at lock_path, which is deleted on release. A process that was
+    waiting on the deleted file tries again with a new one.
+    """
+    while True:
+        lock = open(lock_path, "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            st = os.stat(lock_path)
+            if (st.st_dev, st.st_ino) == (os.fstat(lock.fileno()).st_dev, os.fstat(lock.fileno()).st_ino):
+                break
+        except FileNotFoundError:
+            pass
+        lock.close()
+    try:
+        yield
+    finally:
+        # (still holding the flock, so that no other process can have locked this file in the
+        # meantime)
+        os.unlink(lock_path)
+        lock.close()
+
+
+class PartJournal:
+    """
+    the completed pieces of a partial download (offset => MD5 & CRC32 digests), journaled beside
+    the partial file: a JSON header line with the object's ETag, size and piece size (if those don't
+    match, it starts afresh), then one line appended per piece. Each piece must be fsync'd to the
+    partial file before it's added, so that a journaled piece is on disk even after a host crash.
+    """
+
+    def __init__(self, filename: str, etag: str, size: int, piece_size: int):
+        self._path = filename + ".parts"
+        self._lock = threading.Lock()
+        self.done: Dict[int, Tuple[bytes, bytes]] = {}
+        header = (json.dumps({"etag": etag, "size": size, "piece_size": piece_size}) + "\n").encode()
+        valid = 0  # length of the journal up to its last complete line
+        try:
+            with open(self._path, "rb") as infile:
+                if infile.readline() == header and os.path.getsize(filename) == size:
+                    valid = len(header)
+                    for line in infile:
+                        if not line.endswith(b"\n"):
+                            break  # torn by a crash
+                        (ofs, md5, crc32) = line.split()
+                        self.done[int(ofs)] = (bytes.fromhex(md5.decode()), bytes.fromhex(crc32.decode()))
+                        valid += len(line)
+        except (OSError, ValueError):
+            self.done = {}
+        if self.done:
+            self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND)
+            os.ftruncate(self._fd, valid)
+        else:
+            self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.write(self._fd, header)
+            os.fsync(self._fd)
+
+    def add(self, ofs: int, digests: Tuple[bytes, bytes]) -> None:
+        # one small O_APPEND write per piece is atomic, so concurrent pieces needn't take turns
+        os.write(self._fd, f"{ofs} {digests[0].hex()} {digests[1].hex()}\n".encode())
+        os.fsync(self._fd)
+        with self._lock:
+            self.done[ofs] = digests
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def download_object(
+    cfg,
+    logger,
+    bucket: str,
+    key: str,
+    filename: str,
+    head: Optional[Dict[str, Any]] = None,
+    listed: bool = False,
+    resumable: bool = False,
+) -> None:
+    """
+    parallel ranged GETs into filename, each conditional on the ETag so that all pieces come from
+    the same version of the object, then checksum verification. The ranges of a multipart object
+    are its original parts, so that its composite checksum or ETag can be checked part by part.
+
+    head may instead be the object's ListObjectsV2 entry (listed=True), with its size & ETag; it's
+    then HEADed only if needed to verify the download. If resumable, pieces already in filename per
+    its PartJournal aren't downloaded again.
+    """
+    client = s3_client(bucket)
+    if head is None:
+        head = client.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    size = head["ContentLength"]
+    # a multipart object's ETag ends with -N, N being the number of parts
+    etag = head["ETag"]
+    parts_count = int(etag.strip('"').split("-")[1]) if "-" in etag else 1
+    if parts_count > 1:
+        # every part but the last has the first part's size, as with all common multipart uploaders
+        piece_size = client.head_object(Bucket=bucket, Key=key, PartNumber=1)["ContentLength"]
+        if piece_size * (parts_count - 1) >= size or piece_size * parts_count < size:
+            raise IOError(f"s3://{bucket}/{key}: unexpected multipart layout")
+    else:
+        piece_size = cfg["s3parcp"].get_int("part_size_mb", 16) * 1048576
+    pieces = [(ofs, min(piece_size, size - ofs)) for ofs in range(0, size, piece_size)]
+
+    journal = PartJournal(filename, etag, size, piece_size) if resumable else None
+
+    def get_piece(piece: Tuple[int, int]) -> Tuple[bytes, bytes]:
+        (ofs, length) = piece
+        if journal and ofs in journal.done:
+            return journal.done[ofs]
+        rslt = client.get_object(Bucket=bucket, Key=key, IfMatch=etag, Range=f"bytes={ofs}-{ofs + length - 1}")
+        md5 = hashlib.md5()
+        crc32 = 0
+        pos = ofs
+        with open(filename, "r+b") as outfile:
+            for chunk in rslt["Body"].iter_chunks(1048576):
+                md5.update(chunk)
+                crc32 = zlib.crc32(chunk, crc32)
+                os.pwrite(outfile.fileno(), chunk, pos)
+                pos += len(chunk)
+            if pos - ofs != length:
+                raise IOError(f"s3://{bucket}/{key}: expected {length} bytes at offset {ofs}, received {pos - ofs}")
+            digests = (md5.digest(), crc32.to_bytes(4, "big"))
+            if journal:
+                # the piece's digests are trusted on resumption, so it must be durable first
+                os.fsync(outfile.fileno())
+                journal.add(ofs, digests)
+        return digests
+
+    if journal and journal.done:
+        logger.info(
+            _(
+                "resuming partial download",
+                uri=f"s3://{bucket}/{key}",
+                pieces_done=len(journal.done),
+                pieces=len(pieces),
+            )
+        )
+    else:
+        with open(filename, "wb") as outfile:
+            outfile.truncate(size)
+    try:
+        if len(pieces) > 1:
+            concurrency = cfg["s3parcp"].get_int("in_process_concurrency", 8)
+            with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+                digests = list(executor.map(get_piece, pieces))
+        else:
+            digests = [get_piece(piece) for piece in pieces]
+    finally:
+        if journal:
+            journal.close()
+    try:
+        verify(logger, f"s3://{bucket}/{key}", filename, head, parts_count, digests)
+    except ChecksumMismatch:
+        if not listed:
+            raise
+        # the listing doesn't give the checksum, nor tell whether the ETag is an MD5 (not if the
+        # object is SSE-KMS encrypted)
+        head = client.head_object(Bucket=bucket, Key=key, IfMatch=etag, ChecksumMode="ENABLED")
+        verify(logger, f"s3://{bucket}/{key}", filename, head, parts_count, digests)
+    logger.debug(_("downloaded in-process", uri=f"s3://{bucket}/{key}", file=filename, size=size, pieces=len(pieces)))
+
+
+def main_directory(cfg, logger, uri, **kwargs):
+    """
+    directory download plugin for s3://bucket/prefix/ URIs: in-process like main() (under the same
+    conditions), or else miniwdl's built-in aws s3 cp task
+    """
+    if cfg["s3parcp"].get_bool("in_process", False) and download_cacheable(cfg, logger, uri, directory=True):
+        try:
+            directory = download_directory(cfg, logger, uri)
+        except Exception as exn:
+            logger.warning(
+                _("in-process directory download failed; retrying with aws s3 cp container", uri=uri, error=str(exn))
+            )
+        else:
+            yield {"outputs": {"directory": directory}}
+            return
+    yield from awscli_directory_downloader(cfg, logger, uri, **kwargs)
+
+
+def download_directory(cfg, logger, uri: str) -> str:
+    """
+    download all objects under the prefix into a new download directory, as a tree mirroring their
+    keys below the prefix; returns the path of the tree's root
+    """
+    parsed = urlparse(uri)
+    bucket, prefix = parsed.hostname, parsed.path[1:].rstrip("/")
+    assert bucket and prefix, f"invalid S3 directory URI: {uri}"
+    prefix += "/"
+    concurrency = cfg["s3parcp"].get_int("directory_concurrency", 16)
+    objects = list_prefix(bucket, prefix, concurrency)
+    download_dir = new_download_dir(cfg)
+    root = os.path.join(download_dir, os.path.basename(prefix[:-1]))
+    try:
+        os.makedirs(root)
+        files = []
+        for obj in objects:
+            parts = obj["Key"][len(prefix):].split("/")
+            if any(part in ("", ".", "..") for part in parts[:-1]) or parts[-1] in (".", ".."):
+                raise ValueError(f"can't materialize s3://{bucket}/{obj['Key']} under {uri}")
+            path = os.path.join(root, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if parts[-1]:
+                files.append((obj, path))
+            # else a "folder" placeholder object
+
+        def get_file(item):
+            (obj, path) = item
+            listed = {"ContentLength": obj["Size"], "ETag": obj["ETag"]}
+            download_object(cfg, logger, bucket, obj["Key"], path, listed, listed=True)
+
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _fut in executor.map(get_file, files):
+                pass
+    except BaseException:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise
+    logger.info(
+        _(
+            "downloaded directory in-process",
+            uri=uri,
+            directory=root,
+            files=len(files),
+            bytes=sum(obj["Size"] for (obj, _path) in files),
+        )
+    )
+    return root
+
+
+def list_prefix(bucket: str, prefix: str, concurrency: int) -> List[Dict[str, Any]]:
+    """
+    list all objects under prefix, with paginated ListObjectsV2 calls for each "subdirectory"
+    (delimited by /) running in parallel
+    """
+    client = s3_client(bucket)
+
+    def list_level(level_prefix: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+        contents: List[Dict[str, Any]] = []
+        subprefixes: List[str] = []
+        for page in client.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=level_prefix, Delimiter="/"
+        ):
+            contents.extend(page.get("Contents", []))
+            subprefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+        return (contents, subprefixes)
+
+    objects: List[Dict[str, Any]] = []
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {executor.submit(list_level, prefix)}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for fut in done:
+                contents, subprefixes = fut.result()
+                objects.extend(contents)
+                pending |= {executor.submit(list_level, subprefix) for subprefix in subprefixes}
+    if not objects:
+        raise FileNotFoundError(f"no objects under s3://{bucket}/{prefix}")
+    return objects
+
+
+def b64(digest: bytes) -> str:
+    return base64.b64encode(digest).decode()
+
+
+def verify(
+    logger, uri: str, filename: str, head: Dict[str, Any], parts_count: int, digests: List[Tuple[bytes, bytes]]
+) -> None:
+    """
+    check the downloaded file against the checksum S3 stores for the object, or else its ETag if
+    that's an MD5 (i.e. unless encrypted with SSE-KMS/SSE-C); raises IOError on mismatch. The CRC32
+    of a multipart upload is composite unless its ChecksumType is FULL_OBJECT.
+    """
+    md5_etag = head.get("ServerSideEncryption") != "aws:kms" and "SSECustomerAlgorithm" not in head
+    etag = head["ETag"].strip('"')
+    composite_crc32 = "ChecksumCRC32" in head and head.get("ChecksumType") != "FULL_OBJECT"
+    expected = actual = None
+    if parts_count > 1 and composite_crc32:
+        # composite checksum/ETag: digest of the concatenated part digests (with -N suffix)
+        expected = head["ChecksumCRC32"].split("-")[0]
+        actual = b64(zlib.crc32(b"".join(crc32 for (_md5, crc32) in digests)).to_bytes(4, "big"))
+    elif parts_count > 1 and md5_etag:
+        expected = etag
+        actual = hashlib.md5(b"".join(md5 for (md5, _crc32) in digests)).hexdigest() + f"-{parts_count}"
+    elif parts_count <= 1 and len(digests) == 1 and "ChecksumCRC32" in head:
+        expected, actual = head["ChecksumCRC32"], b64(digests[0][1])
+    elif parts_count <= 1 and len(digests) == 1 and md5_etag and "-" not in etag:
+        expected, actual = etag, digests[0][0].hex()
+    elif "ChecksumCRC32" in head or (md5_etag and "-" not in etag):
+        # the ranged GETs didn't line up with anything S3 checksummed (or the multipart object has a
+        # FULL_OBJECT CRC32), so read the file back
+        crc32 = 0
+        md5 = hashlib.md5()
+        with open(filename, "rb") as infile:
+            for chunk in iter(lambda: infile.read(1048576), b""):
+                crc32 = zlib.crc32(chunk, crc32)
+                md5.update(chunk)
+        if "ChecksumCRC32" in head:
+            expected, actual = head["ChecksumCRC32"], b64(crc32.to_bytes(4, "big"))
+        else:
+            expected, actual = etag, md5.hexdigest()
+    if expected is None:
+        logger.warning(_("no checksum available to verify in-process download", uri=uri))
+    elif expected != actual:
+        raise ChecksumMismatch(f"{uri}: checksum mismatch after download ({actual} != {expected})")
+
+
+class ChecksumMismatch(IOError):
+    pass
+
+
+class DownloadCache:
+    """
+    local content cache of S3 objects, stored as entries/<digest of bucket, key & ETag>/<basename>.
+    Entries are created by atomic rename and their directories' mtimes record last use; insertion
+    and eviction hold an exclusive flock on the cache, so that concurrent processes can share it.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries_dir = os.path.join(cache_dir, "entries")
+        self._tmp_dir = os.path.join(cache_dir, "tmp")
+        os.makedirs(self._entries_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def _entry(self, uri: str, head: Dict[str, Any]) -> str:
+        bucket, key = bucket_key(uri)
+        digest = hashlib.sha256("\n".join([bucket, key, head["ETag"]]).encode()).hexdigest()
+        return os.path.join(self._entries_dir, digest)
+
+    def _lock(self):
+        lock = open(os.path.join(self.cache_dir, "_lock"), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def get(self, logger, uri: str, head: Dict[str, Any], download_dir: str) -> Optional[str]:
+        """
+        link the cached copy of the object into download_dir, if present; returns its path there
+        """
+        entry = self._entry(uri, head)
+        cached = os.path.join(entry, os.path.basename(bucket_key(uri)[1]))
+        filename = os.path.join(download_dir, os.path.basename(cached))
+        try:
+            if os.path.getsize(cached) != head["ContentLength"]:
+                raise FileNotFoundError(cached)
+            link_or_clone(cached, filename)
+            os.utime(entry)
+        except FileNotFoundError:
+            # absent, or evicted just now
+            shutil.rmtree(download_dir, ignore_errors=True)
+            return None
+        logger.info(_("s3parcp download cache hit", uri=uri, cached=cached))
+        return filename
+
+    def put(self, logger, uri: str, head: Dict[str, Any], filename: str) -> None:
+        """
+        add the downloaded file to the cache (by hard link, if possible), then evict least recently
+        used entries to keep the cache under its size limit
+        """
+        entry = self._entry(uri, head)
+        if os.path.exists(entry) or os.path.getsize(filename) > self.max_bytes:
+            return
+        tmp = tempfile.mkdtemp(dir=self._tmp_dir)
+        try:
+            cached = os.path.join(tmp, os.path.basename(bucket_key(uri)[1]))
+            link_or_clone(filename, cached)
+            # read-only, since the cached file may be hard-linked into tasks
+            os.chmod(cached, 0o444)
+            with self._lock():
+                try:
+                    os.rename(tmp, entry)
+                except OSError as exn:
+                    if exn.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                        raise
+                    return
+                logger.info(_("s3parcp download cache insert", uri=uri, cached=entry))
+                self._evict(logger)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _evict(self, logger) -> None:
+        # (with lock held)
+        entries = []
+        for digest in os.listdir(self._entries_dir):
+            entry = os.path.join(self._entries_dir, digest)
+            size = sum(os.path.getsize(os.path.join(entry, fn)) for fn in os.listdir(entry))
+            entries.append((os.stat(entry).st_mtime, size, entry))
+        total = sum(size for (_mtime, size, _entry) in entries)
+        for (_mtime, size, entry) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # move aside atomically, so readers never see a partial entry
+            doomed = tempfile.mkdtemp(dir=self._tmp_dir)
+            os.rename(entry, os.path.join(doomed, "entry"))
+            shutil.rmtree(doomed)
+            total -= size
+            logger.info(_("s3parcp download cache evict", cached=entry, bytes=size))
+
+
+_download_cache = None
+_download_cache_lock = threading.Lock()
+
+
+def cache_put(logger, cache: DownloadCache, uri: str, head: Dict[str, Any], filename: str, recheck=False) -> None:
+    # failure to cache shouldn't fail the download
+    try:
+        if not recheck or head_object(uri)["ETag"] == head["ETag"]:
+            cache.put(logger, uri, head, filename)
+    except Exception as exn:
+        logger.warning(_("s3parcp download cache insert failed", uri=uri, error=str(exn)))
+
+
+def download_cache(cfg) -> Optional[DownloadCache]:
+    global _download_cache
+    if not cfg.has_option("s3parcp", "cache_dir"):
+        return None
+    with _download_cache_lock:
+        if _download_cache is None:
+            _download_cache = DownloadCache(
+                cfg["s3parcp"]["cache_dir"],
+                int(cfg["s3parcp"].get_float("cache_max_gb", 100) * 2**30),
+            )
+        return _download_cache
+
+
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def link_or_clone(src: str, dst: str) -> None:
+    """
+    hard-link src to dst, or failing that (e.g. across filesystems) reflink it if the filesystem
+    supports that, or else copy it
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError as exn:
+        if exn.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+    with open(src, "rb") as infile, open(dst, "wb") as outfile:
+        try:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(infile, outfile, 1048576)
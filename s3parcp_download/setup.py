@@ -26,5 +26,6 @@ setup(
     reentry_register=True,
     entry_points={
         "miniwdl.plugin.file_download": ["s3 = miniwdl_s3parcp:main"],
+        "miniwdl.plugin.directory_download": ["s3 = miniwdl_s3parcp:main_directory"],
     }
 )
@@ -9,30 +9,78 @@ to store the output files (e.g. "s3://my_bucket/workflow123_outputs"). The prefi
 uniquely for each run, to prevent different runs from overwriting each others' outputs.
 
 Shells out to s3parcp, for which the environment must be set up to authorize upload to the
-specified bucket (without explicit auth-related arguments).
+specified bucket (without explicit auth-related arguments). Alternatively, setting
+MINIWDL__S3_PROGRESSIVE_UPLOAD__UPLOAD_BACKEND=boto3 uploads in-process through the module's
+boto3 client instead of spawning s3parcp for each file: single PUT for files smaller than
+multipart_threshold_mb, otherwise a multipart upload with multipart_concurrency parts in flight,
+each request carrying a CRC32 checksum which S3 verifies on receipt. Uploads from all tasks share
+one bounded thread pool, sized by MINIWDL__S3_PROGRESSIVE_UPLOAD__MAX_CONCURRENT_UPLOADS (default 8).
+With MINIWDL__S3_PROGRESSIVE_UPLOAD__DIRECTORY_MANIFEST=true, each uploaded Directory output is
+accompanied by a manifest object listing its files' relative paths, sizes and checksums. With
+MINIWDL__S3_PROGRESSIVE_UPLOAD__SKIP_EXISTING=true, files whose destination object already exists
+with matching size and checksum (e.g. when retrying a run) aren't uploaded again. With
+MINIWDL__S3_PROGRESSIVE_UPLOAD__ASYNC_UPLOADS=true, each task completes without waiting for its
+uploads, which continue in the background; the workflow then waits for them all to finish (and
+fails if any did) before writing outputs.s3.json.
+
+The call cache backend lists the cache/ folder under the call cache URI prefix in one request, and
+serves lookups of absent entries from that listing for MINIWDL__S3_PROGRESSIVE_UPLOAD__CALL_CACHE_INDEX_TTL
+seconds (default 600; 0 to look up each entry in S3).
+
+Uploaded objects are tagged according to their class: call cache entries with the JSON dict
+MINIWDL__S3_PROGRESSIVE_UPLOAD__CACHE_TAGS (default {"swipe_temporary": "true"}), task outputs with
+INTERMEDIATE_TAGS, and outputs.s3.json with FINAL_TAGS (both default {}). The tags are part of the
+upload request itself, except with s3parcp which needs a separate tagging request. Top-level
+workflow outputs, known only at workflow completion, are then retagged from intermediate to final.
+
+Setting MINIWDL__S3_PROGRESSIVE_UPLOAD__JOURNAL_FILE to a path that persists across attempts (e.g.
+alongside the call cache) keeps a SQLite journal of completed uploads. If the runner dies and the
+run is resumed, files already uploaded and unchanged since aren't uploaded again, and outputs of
+tasks that finished before the interruption are still rewritten to their S3 URIs.
 
 Deposits into each successful task/workflow run directory and S3 folder, an additional file
 outputs.s3.json which copies outputs.json replacing local file paths with the uploaded S3 URIs.
 (The JSON printed to miniwdl standard output keeps local paths.)
 
-Limitations:
-1) All task output files are uploaded, even ones that aren't top-level workflow outputs. (We can't,
-   at the moment of task completion, necessarily predict which files the calling workflow will
-   finally output.)
-2) Doesn't upload (or rewrite outputs JSON for) workflow output files that weren't generated by a
-   task, e.g. outputting an input file, or a file generated by write_lines() etc. in the workflow.
-   (We could handle such stragglers by uploading them at workflow completion; it just hasn't been
-   needed yet.)
+Workflow output files that weren't generated by a task, e.g. outputting an input file, or a file
+generated by write_lines() etc. in the workflow, are uploaded (concurrently) at workflow completion.
+
+At workflow start, the plugin analyzes the workflow's dataflow to classify each call output as
+reachable from the workflow outputs or not. Reachable ones are uploaded (and tagged final) upon task
+completion. The others are too by default, but MINIWDL__S3_PROGRESSIVE_UPLOAD__UNREACHABLE_OUTPUTS
+can be set to "defer" (upload in the background, without holding up the task) or "skip" (don't
+upload; note that calls with skipped outputs then aren't inserted into the S3 call cache).
+
+If S3 throttles uploads (503 SlowDown) or an upload fails transiently, it's retried with jittered
+exponential backoff, up to MINIWDL__S3_PROGRESSIVE_UPLOAD__MAX_UPLOAD_ATTEMPTS (default 5). Meanwhile
+the number of concurrent uploads to the affected bucket/prefix is halved, recovering gradually as
+uploads succeed again. MINIWDL__S3_PROGRESSIVE_UPLOAD__MAX_UPLOAD_MIB_PER_S optionally caps the total
+upload bandwidth.
+
+Files whose names match one of the JSON list MINIWDL__S3_PROGRESSIVE_UPLOAD__COMPRESS_GLOBS (e.g.
+["*.fasta", "*.tsv"]; default none) are gzipped on the fly as they're uploaded (through boto3, with no
+compressed copy on local disk). By default (COMPRESS_MODE=suffix) they're stored under the original
+name plus .gz; with COMPRESS_MODE=content_encoding, under the original name with Content-Encoding:
+gzip. Either way outputs.s3.json refers to the objects as stored. Files in Directory outputs keep their
+names: they're compressed only in content_encoding mode.
 """
 
 import os
+import base64
+import fnmatch
+import hashlib
+import zlib
 import subprocess
 import threading
 import json
 import logging
+import random
+import sqlite3
+import time
+from concurrent import futures
 from pathlib import Path
-from urllib.parse import urlparse
-from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlencode, urlparse
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 import WDL
 from WDL import Env, Value, values_to_json
@@ -42,9 +90,14 @@ from WDL._util import StructuredLogMessage as _
 
 import boto3
 import botocore
+import botocore.config
 
 s3 = boto3.resource("s3", endpoint_url=os.getenv("AWS_ENDPOINT_URL"))
-s3_client = boto3.client("s3", endpoint_url=os.getenv("AWS_ENDPOINT_URL"))
+s3_client = boto3.client(
+    "s3",
+    endpoint_url=os.getenv("AWS_ENDPOINT_URL"),
+    config=botocore.config.Config(max_pool_connections=64),
+)
 
 
 def s3_object(uri: str):
@@ -67,21 +120,29 @@ def get_s3_get_prefix(cfg: config.Loader) -> str:
     return s3prefix
 
 
-def flag_temporary(s3uri):
+def upload_tags(cfg: config.Loader, output_class: str) -> Dict[str, str]:
+    """
+    tags to apply to uploaded objects of the given class -- "cache" (call cache JSON),
+    "intermediate" (task outputs) or "final" (workflow outputs) -- from the JSON dict option
+    [s3_progressive_upload] {output_class}_tags
+    """
+    default = {"swipe_temporary": "true"} if output_class == "cache" else {}
+    tags = cfg["s3_progressive_upload"].get_dict(f"{output_class}_tags", default)
+    return {str(k): str(v) for (k, v) in tags.items()}
+
+
+def put_tags(s3uri: str, tags: Dict[str, str]):
+    # replace the tags of an existing object
     uri = urlparse(s3uri)
     bucket, key = uri.hostname, uri.path[1:]
-    s3_client.put_object_tagging(
-        Bucket=bucket,
-        Key=key,
-        Tagging={
-            'TagSet': [
-                {
-                    'Key': 'swipe_temporary',
-                    'Value': 'true'
-                },
-            ]
-        },
-    )
+    if tags:
+        s3_client.put_object_tagging(
+            Bucket=bucket,
+            Key=key,
+            Tagging={"TagSet": [{"Key": k, "Value": v} for (k, v) in tags.items()]},
+        )
+    else:
+        s3_client.delete_object_tagging(Bucket=bucket, Key=key)
 
 
 def inode(link: str):
@@ -90,32 +151,211 @@ def inode(link: str):
 
 
 _uploaded_files: Dict[Tuple[int, int], str] = {}
-_cached_files: Dict[Tuple[int, int], Tuple[str, Env.Bindings[Value.Base]]] = {}
+# call cache entries waiting for their output files to be uploaded: the outputs, and the inodes
+# still outstanding. _cached_files maps each outstanding inode to the cache keys waiting on it.
+_cache_pending: Dict[str, Tuple[Env.Bindings[Value.Base], Set[Tuple[int, int]]]] = {}
+_cached_files: Dict[Tuple[int, int], Set[str]] = {}
+# inodes of the files (and directories with member files) uploaded gzipped, whose objects can't
+# stand in for them in call cache entries
+_compressed_files: Set[Tuple[int, int]] = set()
 _uploaded_files_lock = threading.Lock()
 
 
+class UploadJournal:
+    """
+    durable SQLite record of completed uploads, keyed by the local file's real path, inode, size
+    and mtime, so that a run resumed after the runner died can skip files already uploaded, and
+    rewrite outputs.s3.json for tasks that finished before it was interrupted
+    """
+
+    def __init__(self, filename: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER,"
+                " size INTEGER, mtime_ns INTEGER, uri TEXT NOT NULL, checksum TEXT)"
+            )
+
+    @staticmethod
+    def _stat(path: str) -> Tuple[str, int, int, int, int]:
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return (path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def add(self, path: str, uri: str, checksum: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._stat(path) + (uri, checksum),
+            )
+
+    def get(self, path: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        URI & checksum to which the file was uploaded, if it's unchanged since
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT uri, checksum FROM uploads WHERE path = ? AND dev = ? AND ino = ? AND size = ?"
+                " AND mtime_ns = ?",
+                self._stat(path),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def replay(self, s3prefix: str) -> Dict[Tuple[int, int], str]:
+        """
+        {inode: URI} for the journaled files still present & unchanged, that were uploaded under
+        s3prefix (the journal may be shared by runs with different prefixes)
+        """
+        s3prefix = s3prefix.rstrip("/") + "/"
+        with self._lock:
+            rows = self._conn.execute("SELECT path, dev, ino, size, mtime_ns, uri FROM uploads").fetchall()
+        ans = {}
+        for row in rows:
+            if not row[5].startswith(s3prefix):
+                continue
+            try:
+                if self._stat(row[0]) == tuple(row[:5]):
+                    ans[(row[1], row[2])] = row[5]
+            except OSError:
+                pass
+        return ans
+
+
+_journal: Optional[UploadJournal] = None
+_journal_lock = threading.Lock()
+
+
+def upload_journal(cfg: config.Loader, logger: logging.Logger) -> Optional[UploadJournal]:
+    """
+    the journal at [s3_progressive_upload] journal_file if set, opened (and its uploads under the
+    current uri_prefix replayed into _uploaded_files) on first use
+    """
+    global _journal
+    if not cfg.has_option("s3_progressive_upload", "journal_file"):
+        return None
+    with _journal_lock:
+        if _journal is None:
+            filename = cfg["s3_progressive_upload"]["journal_file"]
+            Path(filename).parent.mkdir(parents=True, exist_ok=True)
+            _journal = UploadJournal(filename)
+            replayed = _journal.replay(get_s3_put_prefix(cfg))
+            with _uploaded_files_lock:
+                _uploaded_files.update(replayed)
+            logger.info(_("replayed upload journal", journal=filename, uploads=len(replayed)))
+        return _journal
+
+
+def record_upload(
+    cfg: config.Loader,
+    logger: logging.Logger,
+    path: str,
+    ino: Tuple[int, int],
+    s3uri: str,
+    checksum: Optional[str] = None,
+    compressed: bool = False,
+):
+    """
+    record in _uploaded_files (keyed by inode, so that it can be found from any symlink or
+    hardlink) and the journal, and write any call cache entry for which this was the last
+    outstanding file. compressed marks files uploaded gzipped (or directories with such files).
+    """
+    journal = upload_journal(cfg, logger)
+    if journal is not None:
+        journal.add(path, s3uri, checksum)
+    ready = []
+    with _uploaded_files_lock:
+        _uploaded_files[ino] = s3uri
+        if compressed:
+            _compressed_files.add(ino)
+        for key in _cached_files.pop(ino, set()):
+            outputs, outstanding = _cache_pending[key]
+            outstanding.discard(ino)
+            if not outstanding:
+                del _cache_pending[key]
+                ready.append((key, outputs))
+    for (key, outputs) in ready:
+        cache_put(cfg, logger, key, outputs)
+
+
 def cache_put(cfg: config.Loader, logger: logging.Logger, key: str, outputs: Env.Bindings[Value.Base]):
+    """
+    write the call cache entry, once all its output files have been uploaded. Skipped if any of
+    them was uploaded gzipped: a cache hit would hand downstream tasks the compressed object in
+    place of the file the task produced.
+    """
     if not (cfg["call_cache"].get_bool("put") and
             cfg["call_cache"]["backend"] == "s3_progressive_upload_call_cache_backend"):
         return
 
-    missing = False
+    compressed = []
 
     def cache(v: Union[Value.File, Value.Directory]) -> str:
-        nonlocal missing
-        missing = missing or inode(str(v.value)) not in _uploaded_files
-        if missing:
-            return ""
-        return _uploaded_files[inode(str(v.value))]
+        ino = inode(str(v.value))
+        if ino in _compressed_files:
+            compressed.append(str(v.value))
+        return _uploaded_files[ino]
 
-    remapped_outputs = Value.rewrite_env_paths(outputs, cache)
-    if not missing and cfg.has_option("s3_progressive_upload", "uri_prefix"):
+    with _uploaded_files_lock:
+        remapped_outputs = Value.rewrite_env_paths(outputs, cache)
+    if compressed:
+        logger.info(_("call cache insert skipped for compressed outputs", key=key, files=compressed))
+        return
+    if cfg.has_option("s3_progressive_upload", "uri_prefix"):
         uri = os.path.join(get_s3_put_prefix(cfg), "cache", f"{key}.json")
-        s3_object(uri).put(Body=json.dumps(values_to_json(remapped_outputs)).encode())
-        flag_temporary(uri)
+        # tags are applied by the PUT itself, so the entry never exists untagged
+        tags = upload_tags(cfg, "cache")
+        s3_object(uri).put(
+            Body=json.dumps(values_to_json(remapped_outputs)).encode(),
+            **({"Tagging": urlencode(tags)} if tags else {}),
+        )
+        call_cache_index_add(uri)
         logger.info(_("call cache insert", cache_file=uri))
 
 
+# bulk listing of the call cache entries under each (bucket, key prefix), with the time it was
+# listed; None if listing isn't permitted
+_call_cache_index: Dict[Tuple[str, str], Tuple[float, Optional[Set[str]]]] = {}
+_call_cache_index_lock = threading.Lock()
+
+
+def call_cache_index(cfg: config.Loader, logger: logging.Logger, bucket: str, prefix: str) -> Optional[Set[str]]:
+    """
+    keys of the call cache entries under s3://bucket/prefix, from one bulk ListObjectsV2 repeated
+    only after call_cache_index_ttl seconds, so that lookups of absent keys needn't touch S3. None
+    if the index is disabled (ttl 0) or unavailable.
+    """
+    ttl = cfg["s3_progressive_upload"].get_float("call_cache_index_ttl", 600.0)
+    if ttl <= 0:
+        return None
+    with _call_cache_index_lock:
+        listed_at, keys = _call_cache_index.get((bucket, prefix), (0.0, None))
+        if time.time() - listed_at > ttl:
+            try:
+                keys = set()
+                for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+                    keys.update(obj["Key"] for obj in page.get("Contents", []))
+                logger.info(_("listed call cache", uri=f"s3://{bucket}/{prefix}", entries=len(keys)))
+                _call_cache_index[(bucket, prefix)] = (time.time(), keys)
+            except botocore.exceptions.ClientError as e:
+                logger.warning(
+                    _("couldn't list call cache; looking up entries individually", error=str(e))
+                )
+                keys = None
+                _call_cache_index[(bucket, prefix)] = (float("inf"), keys)
+        return keys
+
+
+def call_cache_index_add(uri: str) -> None:
+    # reflect our own call cache insertions in any index covering them
+    bucket, key = uri.split("/", 3)[2:]
+    with _call_cache_index_lock:
+        for ((index_bucket, prefix), (_listed_at, keys)) in _call_cache_index.items():
+            if keys is not None and index_bucket == bucket and key.startswith(prefix):
+                keys.add(key)
+
+
 class CallCache(cache.CallCache):
     def get(
         self, key: str, inputs: Env.Bindings[Value.Base], output_types: Env.Bindings[Type.Base]
@@ -126,6 +366,12 @@ class CallCache(cache.CallCache):
         bucket, prefix = uri.hostname, uri.path
 
         key = os.path.join(prefix, "cache", f"{key}.json")[1:]
+        index = None
+        if bucket is not None:
+            index = call_cache_index(self._cfg, self._logger, bucket, os.path.join(prefix, "cache", "")[1:])
+        if index is not None and key not in index:
+            # no S3 request, but we may still have the entry locally
+            return super().get(key, inputs, output_types)
         abs_fn = os.path.join(self._cfg["call_cache"]["dir"], f"{key}.json")
         Path(abs_fn).parent.mkdir(parents=True, exist_ok=True)
         try:
@@ -140,15 +386,410 @@ class CallCache(cache.CallCache):
         if not self._cfg["call_cache"].get_bool("put"):
             return
 
+        inodes = set()
+
         def cache(v: Union[Value.File, Value.Directory]) -> str:
-            _cached_files[inode(v.value)] = (key, outputs)
+            inodes.add(inode(v.value))
             return ""
 
+        Value.rewrite_env_paths(outputs, cache)
+        # count down the output files not yet uploaded; record_upload() writes the entry when the
+        # last one lands
         with _uploaded_files_lock:
-            Value.rewrite_env_paths(outputs, cache)
+            outstanding = inodes - _uploaded_files.keys()
+            if outstanding:
+                _cache_pending[key] = (outputs, outstanding)
+                for ino in outstanding:
+                    _cached_files.setdefault(ino, set()).add(key)
+        if not outstanding:
             cache_put(self._cfg, self._logger, key, outputs)
 
 
+_upload_executor: Optional[futures.ThreadPoolExecutor] = None
+_upload_executor_lock = threading.Lock()
+
+
+def upload_executor(cfg: config.Loader) -> futures.ThreadPoolExecutor:
+    """
+    thread pool shared by all task() hook invocations, bounding the number of concurrent uploads
+    process-wide
+    """
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            max_workers = cfg["s3_progressive_upload"].get_int("max_concurrent_uploads", 8)
+            assert max_workers > 0, "MINIWDL__S3_PROGRESSIVE_UPLOAD__MAX_CONCURRENT_UPLOADS invalid"
+            _upload_executor = futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="s3_progressive_upload"
+            )
+        return _upload_executor
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for uploads to one S3 bucket/prefix: the limit halves whenever S3
+    throttles us, and recovers by one after each limit's worth of unthrottled uploads
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self, throttled: bool) -> None:
+        with self._cond:
+            self._active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class TokenBucket:
+    """
+    caps the aggregate upload bandwidth: consume(n) blocks until n bytes' worth of tokens accrue
+    """
+
+    def __init__(self, bytes_per_s: float):
+        self.rate = bytes_per_s
+        self._tokens = bytes_per_s
+        self._t = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.rate, self._tokens + (now - self._t) * self.rate)
+            self._t = now
+            self._tokens -= nbytes
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+
+
+_upload_limiters: Dict[str, AdaptiveLimiter] = {}
+_bandwidth_limit: Optional[TokenBucket] = None
+_upload_limits_lock = threading.Lock()
+
+
+def upload_limiter(cfg: config.Loader, s3uri: str) -> AdaptiveLimiter:
+    # one limiter per bucket & "folder", as S3 partitions request rate capacity by key prefix
+    prefix = s3uri.rsplit("/", 1)[0]
+    with _upload_limits_lock:
+        if prefix not in _upload_limiters:
+            _upload_limiters[prefix] = AdaptiveLimiter(
+                cfg["s3_progressive_upload"].get_int("max_concurrent_uploads", 8)
+            )
+        return _upload_limiters[prefix]
+
+
+def limit_bandwidth(cfg: config.Loader, nbytes: int) -> None:
+    """
+    wait as needed to keep total upload bandwidth under max_upload_mib_per_s, if set, so that
+    uploads don't starve running tasks' network. Only the in-process (boto3 & compressed) uploads
+    can be paced this way; s3parcp uploads at full speed once started.
+    """
+    global _bandwidth_limit
+    if not cfg.has_option("s3_progressive_upload", "max_upload_mib_per_s"):
+        return
+    with _upload_limits_lock:
+        if _bandwidth_limit is None:
+            _bandwidth_limit = TokenBucket(
+                cfg["s3_progressive_upload"].get_float("max_upload_mib_per_s") * 1048576
+            )
+    _bandwidth_limit.consume(nbytes)
+
+
+_warned_uncapped = False
+
+
+def warn_uncapped(logger: logging.Logger) -> None:
+    global _warned_uncapped
+    with _upload_limits_lock:
+        if _warned_uncapped:
+            return
+        _warned_uncapped = True
+    logger.warning(
+        _(
+            "MINIWDL__S3_PROGRESSIVE_UPLOAD__MAX_UPLOAD_MIB_PER_S doesn't cap s3parcp uploads;"
+            " set MINIWDL__S3_PROGRESSIVE_UPLOAD__UPLOAD_BACKEND=boto3 to apply it"
+        )
+    )
+
+
+class S3parcpFailure(Exception):
+    # the stderr of a failed s3parcp, as the cause of the WDL.Error.RuntimeError
+    pass
+
+
+_THROTTLING_ERROR_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalError",
+    "RequestTimeout",
+}
+
+
+def is_throttling(exn: BaseException) -> bool:
+    """
+    whether the upload failure (or its cause) is S3 throttling or another transient error, worth
+    retrying after backing off
+    """
+    cause: Optional[BaseException] = exn
+    while cause is not None:
+        if isinstance(cause, botocore.exceptions.ClientError):
+            return (
+                cause.response.get("Error", {}).get("Code") in _THROTTLING_ERROR_CODES
+                or cause.response.get("ResponseMetadata", {}).get("HTTPStatusCode") in (500, 503)
+            )
+        if isinstance(
+            cause,
+            (
+                botocore.exceptions.ConnectionError,
+                botocore.exceptions.HTTPClientError,
+            ),
+        ):
+            return True
+        if isinstance(cause, S3parcpFailure):
+            return any(code in str(cause) for code in _THROTTLING_ERROR_CODES) or "503" in str(cause)
+        cause = cause.__cause__
+    return False
+
+
+def scheduled_s3cp(
+    cfg, logger, fn, s3uri, tags: Dict[str, str], stats: Dict[str, Any], compress: Optional[str] = None
+) -> Optional[str]:
+    """
+    s3cp, subject to the adaptive concurrency limit for the destination prefix, retrying with
+    jittered exponential backoff if S3 throttles us (SlowDown) or fails transiently
+    """
+    limiter = upload_limiter(cfg, s3uri)
+    max_attempts = cfg["s3_progressive_upload"].get_int("max_upload_attempts", 5)
+    attempt = 0
+    while True:
+        attempt += 1
+        retries_before = stats.get("retries", 0)
+        limiter.acquire()
+        try:
+            checksum = s3cp(cfg, logger, fn, s3uri, tags, stats, compress)
+        except Exception as exn:
+            throttled = is_throttling(exn)
+            limiter.release(throttled)
+            if not throttled or attempt >= max_attempts:
+                raise
+            delay = random.uniform(0, min(60.0, 0.5 * 2 ** attempt))
+            logger.warning(
+                _(
+                    "upload throttled or failed transiently; retrying",
+                    file=fn,
+                    uri=s3uri,
+                    attempt=attempt,
+                    delay=round(delay, 3),
+                    concurrency_limit=limiter.limit,
+                    error=str(exn.__cause__ or exn),
+                )
+            )
+            stats["retries"] = stats.get("retries", 0) + 1
+            time.sleep(delay)
+            continue
+        # request retries within s3cp also indicate S3 pushing back
+        limiter.release(stats.get("retries", 0) > retries_before)
+        return checksum
+
+
+def when_all(pending: List[futures.Future], fn: Callable[[], Any]) -> futures.Future:
+    """
+    future for the result of fn(), called (in the thread completing the last of them) once all the
+    pending futures are done
+    """
+    done: futures.Future = futures.Future()
+    countdown = [len(pending)]
+    countdown_lock = threading.Lock()
+
+    def on_done(_future=None):
+        with countdown_lock:
+            countdown[0] -= 1
+            if countdown[0] > 0:
+                return
+        try:
+            done.set_result(fn())
+        except BaseException as exn:
+            done.set_exception(exn)
+
+    if pending:
+        for future in pending:
+            future.add_done_callback(on_done)
+    else:
+        countdown[0] = 1
+        on_done()
+    return done
+
+
+# task uploads still in flight, in async_uploads mode, each keyed by the task's run_id
+_pending_uploads: List[Tuple[List[str], futures.Future]] = []
+_pending_uploads_lock = threading.Lock()
+
+
+def wait_for_uploads(logger: logging.Logger, run_id: List[str]) -> None:
+    """
+    barrier: wait for the pending uploads of every task under run_id, raising if any failed
+    """
+    with _pending_uploads_lock:
+        waiting = [future for (task_run_id, future) in _pending_uploads if task_run_id[: len(run_id)] == run_id]
+        _pending_uploads[:] = [
+            (task_run_id, future) for (task_run_id, future) in _pending_uploads if future not in waiting
+        ]
+    if waiting:
+        logger.info(_("waiting for pending task output uploads", tasks=len(waiting)))
+    futures.wait(waiting)
+    failures: List[BaseException] = [exn for exn in (future.exception() for future in waiting) if exn is not None]
+    if failures:
+        raise failures[0]
+
+
+# per-file upload instrumentation, summarized into uploads.stats.json by workflow()
+_upload_stats: List[Dict[str, Any]] = []
+_upload_stats_lock = threading.Lock()
+
+
+def upload_file(
+    cfg: config.Loader,
+    logger: logging.Logger,
+    abs_fn: str,
+    s3uri: str,
+    ino: Tuple[int, int],
+    tags: Dict[str, str],
+    what: str = "task output",
+    run_id: Optional[List[str]] = None,
+    submitted: Optional[float] = None,
+    in_directory: bool = False,
+) -> Optional[str]:
+    """
+    upload one file (unless the journal or S3 shows it's already there) and record it, along with
+    stats about the upload; returns its checksum, if known
+    """
+    started = time.time()
+    stats: Dict[str, Any] = {"retries": 0}
+    compress = compression(cfg, abs_fn, in_directory)
+    if compress == "suffix":
+        s3uri += ".gz"
+    journal = upload_journal(cfg, logger)
+    journaled = journal.get(abs_fn) if journal is not None else None
+    skipped = None
+    if journaled and journaled[0] == s3uri:
+        checksum = journaled[1]
+        skipped = "already uploaded by an earlier attempt"
+    else:
+        existing = None
+        if not compress and cfg["s3_progressive_upload"].get_bool("skip_existing", False):
+            existing = existing_object(cfg, abs_fn, s3uri)
+        if existing is not None:
+            checksum = existing.get("ChecksumCRC32")
+            skipped = "already in S3; skipped upload"
+        else:
+            checksum = scheduled_s3cp(cfg, logger, abs_fn, s3uri, tags, stats, compress)
+    record_upload(cfg, logger, abs_fn, ino, s3uri, checksum, bool(compress))
+
+    seconds = time.time() - started
+    size = os.path.getsize(abs_fn)
+    stats.update(
+        run_id=list(run_id or []),
+        uri=s3uri,
+        bytes=size,
+        skipped=bool(skipped),
+        seconds=seconds,
+        queue_wait_seconds=(started - submitted) if submitted else 0.0,
+    )
+    with _upload_stats_lock:
+        _upload_stats.append(stats)
+    if skipped:
+        logger.info(_(f"{what} {skipped}", file=abs_fn, uri=s3uri))
+    else:
+        logger.info(
+            _(
+                f"{what} uploaded",
+                file=abs_fn,
+                uri=s3uri,
+                bytes=size,
+                seconds=round(seconds, 3),
+                mib_per_s=round(size / 1048576 / max(seconds, 0.001), 1),
+                retries=stats["retries"],
+                queue_wait_seconds=round(stats["queue_wait_seconds"], 3),
+                **({"compressed_bytes": stats["compressed_bytes"]} if "compressed_bytes" in stats else {}),
+            )
+        )
+    return checksum
+
+
+def upload_stats_summary(run_id: List[str]) -> Dict[str, Any]:
+    """
+    summarize the instrumentation of uploads under run_id: overall totals & percentile latencies,
+    and per-task totals
+    """
+    with _upload_stats_lock:
+        records = [stats for stats in _upload_stats if stats["run_id"][: len(run_id)] == run_id]
+
+    def percentiles(values: List[float]) -> Dict[str, float]:
+        values = sorted(values) or [0.0]
+        ans = {f"p{p}": round(values[min(len(values) - 1, len(values) * p // 100)], 3) for p in (50, 90, 99)}
+        ans["max"] = round(values[-1], 3)
+        return ans
+
+    tasks: Dict[str, Dict[str, Any]] = {}
+    for stats in records:
+        totals = tasks.setdefault(
+            "/".join(stats["run_id"][len(run_id):]) or "(workflow)",
+            {"files": 0, "skipped": 0, "bytes": 0, "retries": 0, "seconds": 0.0, "max_seconds": 0.0},
+        )
+        totals["files"] += 1
+        totals["skipped"] += int(stats["skipped"])
+        totals["bytes"] += 0 if stats["skipped"] else stats["bytes"]
+        totals["retries"] += stats["retries"]
+        totals["seconds"] = round(totals["seconds"] + stats["seconds"], 3)
+        totals["max_seconds"] = round(max(totals["max_seconds"], stats["seconds"]), 3)
+    uploaded = [stats for stats in records if not stats["skipped"]]
+    return {
+        "files": len(records),
+        "skipped": len(records) - len(uploaded),
+        "bytes": sum(stats["bytes"] for stats in uploaded),
+        "retries": sum(stats["retries"] for stats in records),
+        "seconds": percentiles([stats["seconds"] for stats in uploaded]),
+        "mib_per_s": percentiles(
+            [stats["bytes"] / 1048576 / max(stats["seconds"], 0.001) for stats in uploaded]
+        ),
+        "queue_wait_seconds": percentiles([stats["queue_wait_seconds"] for stats in records]),
+        "tasks": tasks,
+    }
+
+
+def check_uploads(pending: List[futures.Future], what: str) -> None:
+    """
+    raise WDL.Error.RuntimeError if any of the (done) upload futures failed
+    """
+    failures = [future.exception() for future in pending if future.exception()]
+    if failures:
+        if len(failures) == 1 and isinstance(failures[0], WDL.Error.RuntimeError):
+            raise failures[0]
+        raise WDL.Error.RuntimeError(f"failed uploading {len(failures)} of {len(pending)} {what}") from failures[0]
+
+
 def task(cfg, logger, run_id, run_dir, task, **recv):
     """
     on completion of any task, upload its output files to S3, and record the S3 URI corresponding
@@ -161,16 +802,6 @@ def task(cfg, logger, run_id, run_dir, task, **recv):
     # ignore command/runtime/container
     recv = yield recv
 
-    def upload_file(abs_fn, s3uri):
-        s3cp(logger, abs_fn, s3uri)
-        # record in _uploaded_files (keyed by inode, so that it can be found from any
-        # symlink or hardlink)
-        with _uploaded_files_lock:
-            _uploaded_files[inode(abs_fn)] = s3uri
-            if inode(abs_fn) in _cached_files:
-                cache_put(cfg, logger, *_cached_files[inode(abs_fn)])
-        logger.info(_("task output uploaded", file=abs_fn, uri=s3uri))
-
     if not cfg.has_option("s3_progressive_upload", "uri_prefix"):
         logger.debug("skipping because MINIWDL__S3_PROGRESSIVE_UPLOAD__URI_PREFIX is unset")
         yield recv
@@ -186,29 +817,55 @@ def task(cfg, logger, run_id, run_dir, task, **recv):
     def _raise(ex):
         raise ex
 
+    def stat_file(abs_fn, s3uri):
+        # stat each file just once, during enumeration
+        st = os.stat(abs_fn)
+        return (abs_fn, s3uri, (st.st_dev, st.st_ino), st.st_size)
+
+    # classify the outputs by whether they may flow into the workflow's outputs (all of them, absent
+    # the dataflow analysis)
+    reachable = _reachable_outputs.get(run_id[0]) if len(run_id) > 1 else None
+    call_path = tuple(call_run_id.split("-")[1] for call_run_id in run_id[1:])
+    unreachable_policy = cfg["s3_progressive_upload"].get("unreachable_outputs", "upload")
+    assert unreachable_policy in ("upload", "defer", "skip"), (
+        "MINIWDL__S3_PROGRESSIVE_UPLOAD__UNREACHABLE_OUTPUTS invalid"
+    )
+
+    # (uploads, directories) for the reachable & unreachable outputs
+    groups: Dict[bool, Tuple[List[Tuple[str, str, Tuple[int, int], int]], List[Tuple[str, str, range]]]] = {
+        True: ([], []),
+        False: ([], []),
+    }
     links_dir = os.path.join(run_dir, "out")
     for output in os.listdir(links_dir):
         abs_output = os.path.join(links_dir, output)
         assert os.path.isdir(abs_output)
         output_contents = [os.path.join(abs_output, fn) for fn in os.listdir(abs_output) if not fn.startswith(".")]
         assert output_contents
+        uploads, directories = groups[reachable is None or is_reachable(reachable, call_path, output)]
         if len(output_contents) == 1 and os.path.isdir(output_contents[0]) and os.path.islink(output_contents[0]):
-            # directory output
-            _uploaded_files[inode(output_contents[0])] = (
-                os.path.join(s3prefix, os.path.basename(output_contents[0])) + "/"
-            )
+            # directory output: enumerate the tree once; the directory itself is recorded as
+            # uploaded after all its files are
+            first = len(uploads)
             for (dn, subdirs, files) in os.walk(output_contents[0], onerror=_raise):
                 assert dn == output_contents[0] or dn.startswith(output_contents[0] + "/"), dn
                 for fn in files:
                     abs_fn = os.path.join(dn, fn)
                     s3uri = os.path.join(s3prefix, os.path.relpath(abs_fn, abs_output))
-                    upload_file(abs_fn, s3uri)
+                    uploads.append(stat_file(abs_fn, s3uri))
+            directories.append(
+                (
+                    output_contents[0],
+                    os.path.join(s3prefix, os.path.basename(output_contents[0])) + "/",
+                    range(first, len(uploads)),
+                )
+            )
         elif len(output_contents) == 1 and os.path.isfile(output_contents[0]):
             # file output
             basename = os.path.basename(output_contents[0])
             abs_fn = os.path.join(abs_output, basename)
             s3uri = os.path.join(s3prefix, basename)
-            upload_file(abs_fn, s3uri)
+            uploads.append(stat_file(abs_fn, s3uri))
         else:
             # file array output
             assert all(os.path.basename(abs_fn).isdigit() for abs_fn in output_contents), output_contents
@@ -217,35 +874,220 @@ def task(cfg, logger, run_id, run_dir, task, **recv):
                 assert len(fns) == 1
                 abs_fn = os.path.join(index_dir, fns[0])
                 s3uri = os.path.join(s3prefix, fns[0])
-                upload_file(abs_fn, s3uri)
+                uploads.append(stat_file(abs_fn, s3uri))
+
+    # outputs reachable from the workflow outputs per the dataflow analysis are final, so they can
+    # be tagged as such right away
+    done = start_uploads(
+        cfg,
+        logger,
+        *groups[True],
+        upload_tags(cfg, "final" if run_id[0] in _reachable_outputs else "intermediate"),
+        run_id,
+    )
+    if groups[False][0] and unreachable_policy != "skip":
+        deferred = start_uploads(cfg, logger, *groups[False], upload_tags(cfg, "intermediate"), run_id)
+        if unreachable_policy == "defer":
+            with _pending_uploads_lock:
+                _pending_uploads.append((list(run_id), deferred))
+        else:
+            done = when_all([done, deferred], lambda: None)
+    elif groups[False][0]:
+        logger.info(
+            _("skipping upload of outputs not reachable from workflow outputs", files=len(groups[False][0]))
+        )
+
+    if cfg["s3_progressive_upload"].get_bool("async_uploads", False) and len(run_id) > 1:
+        # let the task complete now; workflow() waits for the uploads before writing outputs.s3.json
+        # (a task run on its own has no workflow() to do so, so it waits right here)
+        with _pending_uploads_lock:
+            _pending_uploads.append((list(run_id), done))
+    else:
+        done.result()
     yield recv
 
 
+def start_uploads(
+    cfg: config.Loader,
+    logger: logging.Logger,
+    uploads: List[Tuple[str, str, Tuple[int, int], int]],
+    directories: List[Tuple[str, str, range]],
+    tags: Dict[str, str],
+    run_id: List[str],
+) -> futures.Future:
+    """
+    upload a task's output files concurrently on the shared pool; returns a future for their
+    completion, which also records the directories they make up (each with the range of its files
+    in uploads)
+    """
+
+    def finish():
+        check_uploads(pending, "task output files")
+
+        for (abs_dn, s3uri, entries) in directories:
+            if cfg["s3_progressive_upload"].get_bool("directory_manifest", False):
+                write_directory_manifest(
+                    logger,
+                    s3uri,
+                    [
+                        (os.path.relpath(uploads[i][0], abs_dn), uploads[i][3], pending[i].result())
+                        for i in entries
+                    ],
+                    tags,
+                )
+            compressed = any(compression(cfg, uploads[i][0], True) for i in entries)
+            record_upload(cfg, logger, abs_dn, inode(abs_dn), s3uri, compressed=compressed)
+
+    executor = upload_executor(cfg)
+    in_directory = {i for (_abs_dn, _s3uri, entries) in directories for i in entries}
+    pending = [
+        executor.submit(
+            upload_file, cfg, logger, abs_fn, s3uri, ino, tags, "task output", run_id, time.time(), i in in_directory
+        )
+        for (i, (abs_fn, s3uri, ino, _size)) in enumerate(uploads)
+    ]
+    return when_all(pending, finish)
+
+
+def write_directory_manifest(
+    logger, s3uri: str, entries: List[Tuple[str, int, Optional[str]]], tags: Optional[Dict[str, str]] = None
+):
+    """
+    write a manifest object (relative path, size & checksum of each file) next to the uploaded
+    directory prefix, e.g. s3://bucket/prefix/dir.manifest.json for s3://bucket/prefix/dir/, with
+    the directory's tags; the checksum is omitted for files whose upload didn't report one (s3parcp
+    backend)
+    """
+    manifest = {
+        "uri": s3uri,
+        "total_size": sum(size for (_path, size, _checksum) in entries),
+        "files": [
+            dict({"path": path, "size": size}, **({"checksum_crc32": checksum} if checksum else {}))
+            for (path, size, checksum) in sorted(entries)
+        ],
+    }
+    uri = s3uri.rstrip("/") + ".manifest.json"
+    s3_object(uri).put(
+        Body=json.dumps(manifest, indent=2).encode(),
+        **({"Tagging": urlencode(tags)} if tags else {}),
+    )
+    logger.info(_("directory manifest uploaded", uri=uri, files=len(entries)))
+
+
+# per top-level workflow run_id, the output names of each call (identified by its path of call names
+# through any subworkflows) that may flow into the workflow outputs; None for all outputs of all
+# calls under the path. A None value for the whole workflow means everything is reachable.
+_reachable_outputs: Dict[str, Optional[Dict[Tuple[str, ...], Optional[Set[str]]]]] = {}
+
+
+def reachable_call_outputs(
+    workflow: WDL.Tree.Workflow, output_names: Optional[Set[str]] = None
+) -> Optional[Dict[Tuple[str, ...], Optional[Set[str]]]]:
+    """
+    walk the workflow's dataflow graph back from its outputs (those named, if given) to find the
+    call outputs they may derive from. Doesn't look through calls: a task output that merely
+    passes through one of the task's input files is uploaded along with that task's outputs.
+    """
+    if workflow.outputs is None:
+        # with no output section, every call output is a workflow output
+        return None
+    ans: Dict[Tuple[str, ...], Optional[Set[str]]] = {}
+    visited: Set[int] = set()
+
+    def add(call_path: Tuple[str, ...], outputs: Optional[Set[str]]):
+        if call_path in ans and (ans[call_path] is None or outputs is None):
+            ans[call_path] = None
+        else:
+            ans[call_path] = (ans.get(call_path) or set()) | (outputs or set())
+
+    def visit_expr(expr: WDL.Expr.Base):
+        if isinstance(expr, WDL.Expr.Ident):
+            visit_referee(expr.referee, expr.name)
+        for child in expr.children:
+            if isinstance(child, WDL.Expr.Base):
+                visit_expr(child)
+
+    def visit_referee(referee, name: str):
+        if isinstance(referee, WDL.Tree.Gather):
+            referee = referee.final_referee
+        if isinstance(referee, WDL.Tree.Call):
+            # name is call_name.output_name, or just call_name for the whole call
+            output = name[len(referee.name) + 1:] if name != referee.name else None
+            if isinstance(referee.callee, WDL.Tree.Workflow):
+                sub = reachable_call_outputs(referee.callee, {output} if output else None)
+                if sub is None:
+                    add((referee.name,), None)
+                else:
+                    for (call_path, outputs) in sub.items():
+                        add((referee.name,) + call_path, outputs)
+            else:
+                add((referee.name,), {output} if output else None)
+        elif isinstance(referee, (WDL.Tree.Decl, WDL.Tree.Scatter)) and id(referee) not in visited:
+            visited.add(id(referee))
+            if referee.expr:
+                visit_expr(referee.expr)
+
+    for decl in workflow.outputs:
+        if output_names is None or decl.name in output_names:
+            visit_referee(decl, decl.name)
+    return ans
+
+
+def is_reachable(reachable: Dict[Tuple[str, ...], Optional[Set[str]]], call_path: Tuple[str, ...], output: str) -> bool:
+    for i in range(1, len(call_path)):
+        if call_path[:i] in reachable and reachable[call_path[:i]] is None:
+            return True
+    if call_path not in reachable:
+        return False
+    outputs = reachable[call_path]
+    return outputs is None or output in outputs
+
+
 def workflow(cfg, logger, run_id, run_dir, workflow, **recv):
     """
-    on workflow completion, add a file outputs.s3.json to the run directory, which is outputs.json
-    with local filenames rewritten to the uploaded S3 URIs (as previously recorded on completion of
-    each task).
+    on workflow completion, upload any (top-level) output files that no task uploaded, then add a file
+    outputs.s3.json to the run directory, which is outputs.json with local filenames rewritten to
+    the uploaded S3 URIs (as previously recorded on completion of each task).
     """
     logger = logger.getChild("s3_progressive_upload")
 
+    if len(run_id) == 1 and cfg.has_option("s3_progressive_upload", "uri_prefix"):
+        # analyze up front which call outputs may flow into the workflow outputs, for task()
+        try:
+            _reachable_outputs[run_id[0]] = reachable_call_outputs(workflow)
+        except Exception as exn:
+            logger.warning(_("workflow dataflow analysis failed; uploading all task outputs", error=str(exn)))
+
     # ignore inputs
     recv = yield recv
 
     if cfg.has_option("s3_progressive_upload", "uri_prefix"):
-        # write outputs.s3.json using _uploaded_files
+        # write outputs.s3.json using _uploaded_files (including uploads replayed from the
+        # journal), once any uploads still pending are done
+        upload_journal(cfg, logger)
+        wait_for_uploads(logger, run_id)
+        s3prefix = os.path.join(get_s3_put_prefix(cfg), *run_id[1:])
+        if len(run_id) == 1 and run_id[0] not in _reachable_outputs:
+            # (with the dataflow analysis, task outputs were tagged final if need be on upload)
+            tag_final_outputs(cfg, logger, recv["outputs"])
+        if len(run_id) == 1:
+            # only the top-level workflow's outputs: a subworkflow's outputs include call outputs
+            # that unreachable_outputs=skip may have deliberately left unuploaded
+            upload_stragglers(cfg, logger, run_id, recv["outputs"], s3prefix, upload_tags(cfg, "final"))
         write_outputs_s3_json(
+            cfg,
             logger,
             recv["outputs"],
             run_dir,
-            os.path.join(get_s3_put_prefix(cfg), *run_id[1:]),
+            s3prefix,
             workflow.name,
         )
+        write_upload_stats(cfg, logger, run_id, run_dir, s3prefix)
 
     yield recv
 
 
-def write_outputs_s3_json(logger, outputs, run_dir, s3prefix, namespace):
+def write_outputs_s3_json(cfg, logger, outputs, run_dir, s3prefix, namespace):
     # rewrite uploaded files to their S3 URIs
     def rewriter(fd):
         try:
@@ -257,7 +1099,7 @@ def write_outputs_s3_json(logger, outputs, run_dir, s3prefix, namespace):
                     path=fd.value,
                 )
             )
-            return fn
+            return fd.value
 
     with _uploaded_files_lock:
         outputs_s3 = WDL.Value.rewrite_env_paths(outputs, rewriter)
@@ -270,24 +1112,455 @@ def write_outputs_s3_json(logger, outputs, run_dir, s3prefix, namespace):
     with open(fn, "w") as outfile:
         json.dump(outputs_s3_json, outfile, indent=2)
         outfile.write("\n")
-    s3cp(logger, fn, os.environ.get("WDL_OUTPUT_URI", os.path.join(s3prefix, "outputs.s3.json")))
+    s3cp(
+        cfg,
+        logger,
+        fn,
+        os.environ.get("WDL_OUTPUT_URI", os.path.join(s3prefix, "outputs.s3.json")),
+        upload_tags(cfg, "final"),
+    )
+
+
+def write_upload_stats(cfg, logger, run_id, run_dir, s3prefix):
+    """
+    write uploads.stats.json, summarizing the instrumentation of the workflow's uploads, next to
+    outputs.s3.json (both locally and in S3)
+    """
+    summary = upload_stats_summary(run_id)
+    logger.info(
+        _(
+            "uploads summary",
+            files=summary["files"],
+            skipped=summary["skipped"],
+            bytes=summary["bytes"],
+            retries=summary["retries"],
+            seconds=summary["seconds"],
+        )
+    )
+    fn = os.path.join(run_dir, "uploads.stats.json")
+    with open(fn, "w") as outfile:
+        json.dump(summary, outfile, indent=2)
+        outfile.write("\n")
+    if "WDL_OUTPUT_URI" in os.environ:
+        s3prefix = os.path.dirname(os.environ["WDL_OUTPUT_URI"])
+    s3cp(cfg, logger, fn, os.path.join(s3prefix, "uploads.stats.json"), upload_tags(cfg, "final"))
 
 
-_s3parcp_lock = threading.Lock()
+def upload_stragglers(cfg, logger, run_id, outputs, s3prefix: str, tags: Dict[str, str]):
+    """
+    concurrently upload workflow output files & directories that weren't uploaded by any task, e.g.
+    a workflow input passed through as an output, or a file generated by write_lines() etc. in the
+    workflow
+    """
+    stragglers: Dict[Tuple[int, int], str] = {}
 
+    def collect(fd):
+        try:
+            ino = inode(fd.value)
+        except OSError:
+            return fd.value
+        with _uploaded_files_lock:
+            if ino not in _uploaded_files:
+                stragglers[ino] = fd.value
+        return fd.value
 
-def s3cp(logger, fn, s3uri):
-    with _s3parcp_lock:
-        cmd = ["s3parcp", "--checksum", fn, s3uri]
-        logger.debug(" ".join(cmd))
-        rslt = subprocess.run(cmd, stderr=subprocess.PIPE)
-        if rslt.returncode != 0:
-            logger.error(
-                _(
-                    "failed uploading output file",
-                    cmd=" ".join(cmd),
-                    exit_status=rslt.returncode,
-                    stderr=rslt.stderr.decode("utf-8"),
+    WDL.Value.rewrite_env_paths(outputs, collect)
+    if not stragglers:
+        return
+
+    def _raise(ex):
+        raise ex
+
+    executor = upload_executor(cfg)
+    pending: List[futures.Future] = []
+    # (path, inode, URI, and the relative path & size of each file with its index in pending)
+    directories: List[Tuple[str, Tuple[int, int], str, List[Tuple[str, int, int]]]] = []
+    for (ino, path) in stragglers.items():
+        basename = os.path.basename(path.rstrip("/"))
+        if os.path.isdir(path):
+            dir_uri = os.path.join(s3prefix, basename) + "/"
+            entries = []
+            for (dn, subdirs, files) in os.walk(path, onerror=_raise):
+                for fn in files:
+                    abs_fn = os.path.join(dn, fn)
+                    entries.append((os.path.relpath(abs_fn, path), os.path.getsize(abs_fn), len(pending)))
+                    pending.append(
+                        executor.submit(
+                            upload_file,
+                            cfg,
+                            logger,
+                            abs_fn,
+                            os.path.join(dir_uri, os.path.relpath(abs_fn, path)),
+                            inode(abs_fn),
+                            tags,
+                            "workflow output",
+                            run_id,
+                            time.time(),
+                            True,
+                        )
+                    )
+            directories.append((path, ino, dir_uri, entries))
+        else:
+            pending.append(
+                executor.submit(
+                    upload_file,
+                    cfg,
+                    logger,
+                    path,
+                    os.path.join(s3prefix, basename),
+                    ino,
+                    tags,
+                    "workflow output",
+                    run_id,
+                    time.time(),
                 )
             )
-            raise WDL.Error.RuntimeError("failed: " + " ".join(cmd))
+    logger.info(_("uploading workflow outputs not uploaded by any task", files=len(pending)))
+    futures.wait(pending)
+    check_uploads(pending, "workflow output files")
+    for (path, ino, dir_uri, entries) in directories:
+        if cfg["s3_progressive_upload"].get_bool("directory_manifest", False):
+            write_directory_manifest(
+                logger, dir_uri, [(rel, size, pending[i].result()) for (rel, size, i) in entries], tags
+            )
+        record_upload(cfg, logger, path, ino, dir_uri)
+
+
+def tag_final_outputs(cfg, logger, outputs):
+    """
+    task outputs were tagged as intermediate when uploaded; once we know which of them are the
+    top-level workflow outputs, retag those as final (if the two tag sets differ)
+    """
+    tags = upload_tags(cfg, "final")
+    if tags == upload_tags(cfg, "intermediate"):
+        return
+
+    uris = []
+
+    def collect(fd):
+        with _uploaded_files_lock:
+            uri = _uploaded_files.get(inode(fd.value)) if os.path.exists(fd.value) else None
+        if uri:
+            uris.append(uri)
+        return fd.value
+
+    WDL.Value.rewrite_env_paths(outputs, collect)
+    object_uris = []
+    for uri in uris:
+        if uri.endswith("/"):
+            bucket, prefix = uri.split("/", 3)[2:]
+            for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+                object_uris.extend(f"s3://{bucket}/{obj['Key']}" for obj in page.get("Contents", []))
+            if cfg["s3_progressive_upload"].get_bool("directory_manifest", False):
+                object_uris.append(uri.rstrip("/") + ".manifest.json")
+        else:
+            object_uris.append(uri)
+    executor = upload_executor(cfg)
+    for future in [executor.submit(put_tags, uri, tags) for uri in object_uris]:
+        future.result()
+    logger.info(_("tagged workflow outputs", objects=len(object_uris), tags=tags))
+
+
+def s3cp(
+    cfg,
+    logger,
+    fn,
+    s3uri,
+    tags: Optional[Dict[str, str]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    compress: Optional[str] = None,
+) -> Optional[str]:
+    """
+    upload fn to s3uri with the configured backend and object tags, gzipping it on the fly if
+    compress is set (see compression()); returns the object's CRC32 checksum, if known. Counts any
+    request retries into stats["retries"].
+    """
+    if compress:
+        # s3parcp can't compress, so these always go through boto3
+        return s3put_gzip(cfg, logger, fn, s3uri, compress == "content_encoding", tags, stats)
+    if cfg["s3_progressive_upload"].get("upload_backend", "s3parcp") == "boto3":
+        return s3put(cfg, logger, fn, s3uri, tags, stats)
+    if cfg.has_option("s3_progressive_upload", "max_upload_mib_per_s"):
+        warn_uncapped(logger)
+    s3parcp(logger, fn, s3uri)
+    if tags:
+        # s3parcp can't tag the object as it uploads it
+        put_tags(s3uri, tags)
+    return None
+
+
+def s3parcp(logger, fn, s3uri):
+    cmd = ["s3parcp", "--checksum", fn, s3uri]
+    logger.debug(" ".join(cmd))
+    rslt = subprocess.run(cmd, stderr=subprocess.PIPE)
+    if rslt.returncode != 0:
+        logger.error(
+            _(
+                "failed uploading output file",
+                cmd=" ".join(cmd),
+                exit_status=rslt.returncode,
+                stderr=rslt.stderr.decode("utf-8"),
+            )
+        )
+        raise WDL.Error.RuntimeError("failed: " + " ".join(cmd)) from S3parcpFailure(
+            rslt.stderr.decode("utf-8")
+        )
+
+
+def crc32(data: bytes) -> str:
+    # base64 of the big-endian CRC32, as expected in S3's x-amz-checksum-crc32 header
+    return base64.b64encode(zlib.crc32(data).to_bytes(4, "big")).decode()
+
+
+def multipart_part_size(cfg: config.Loader, size: int) -> int:
+    """
+    part size for a multipart upload of the given file size; deterministic so that the composite
+    checksum of an existing object can be recomputed locally
+    """
+    part_size = cfg["s3_progressive_upload"].get_int("multipart_part_size_mb", 16) * 1048576
+    while size > part_size * 10000:  # S3 limit on the number of parts
+        part_size *= 2
+    return part_size
+
+
+def compression(cfg: config.Loader, fn: str, in_directory: bool = False) -> Optional[str]:
+    """
+    how to compress fn on upload: None if its name doesn't match any of the compress_globs, or else
+    the compress_mode -- "suffix" (upload gzipped as s3uri + ".gz") or "content_encoding" (upload
+    gzipped to s3uri itself, with Content-Encoding: gzip). Files in a Directory output aren't
+    compressed in suffix mode, which would rename them within the directory.
+    """
+    globs = cfg["s3_progressive_upload"].get_list("compress_globs", [])
+    if not any(fnmatch.fnmatch(os.path.basename(fn), str(pat)) for pat in globs):
+        return None
+    mode = cfg["s3_progressive_upload"].get("compress_mode", "suffix")
+    assert mode in ("suffix", "content_encoding"), "MINIWDL__S3_PROGRESSIVE_UPLOAD__COMPRESS_MODE invalid"
+    return None if in_directory and mode == "suffix" else mode
+
+
+def existing_object(cfg: config.Loader, fn: str, s3uri: str) -> Optional[Dict[str, Any]]:
+    """
+    if s3uri already holds an object identical to the local file, return its HeadObject response.
+    Compares the size, then the CRC32 checksum S3 stores for the object (whole-object, or composite
+    as left by s3put_multipart), or failing that the MD5 ETag: of a single-part upload, or of a
+    multipart upload (as left by s3parcp, which stores no checksum) using the size of its first part.
+    """
+    uri = urlparse(s3uri)
+    bucket, key = uri.hostname, uri.path[1:]
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    except botocore.exceptions.ClientError as e:
+        # 403 is what S3 says about absent keys if we lack ListBucket permission
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "403"):
+            return None
+        raise
+    size = os.path.getsize(fn)
+    if head["ContentLength"] != size:
+        return None
+
+    etag = head.get("ETag", "").strip('"')
+    part_size = multipart_part_size(cfg, size)
+    if "ChecksumCRC32" not in head and "-" in etag:
+        # the multipart ETag depends on the uploader's part size, which the first part tells
+        part_size = s3_client.head_object(Bucket=bucket, Key=key, PartNumber=1)["ContentLength"]
+        if not part_size:
+            return None
+
+    # one pass over the file computing every checksum we might compare
+    whole_crc32 = 0
+    part_crc32s = []
+    md5 = hashlib.md5()
+    part_md5s = []
+    with open(fn, "rb") as infile:
+        for chunk in iter(lambda: infile.read(part_size), b""):
+            whole_crc32 = zlib.crc32(chunk, whole_crc32)
+            part_crc32s.append(zlib.crc32(chunk).to_bytes(4, "big"))
+            md5.update(chunk)
+            part_md5s.append(hashlib.md5(chunk).digest())
+
+    if "ChecksumCRC32" in head:
+        local = {
+            base64.b64encode(whole_crc32.to_bytes(4, "big")).decode(),
+            crc32(b"".join(part_crc32s)),
+        }
+        return head if head["ChecksumCRC32"].split("-")[0] in local else None
+    if "-" in etag:
+        multipart_etag = hashlib.md5(b"".join(part_md5s)).hexdigest() + f"-{len(part_md5s)}"
+        return head if etag == multipart_etag else None
+    return head if etag == md5.hexdigest() else None
+
+
+def s3put(
+    cfg, logger, fn, s3uri, tags: Optional[Dict[str, str]] = None, stats: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    upload in-process using s3_client, with per-part CRC32 checksums verified by S3 (the
+    equivalent of s3parcp --checksum)
+    """
+    uri = urlparse(s3uri)
+    bucket, key = uri.hostname, uri.path[1:]
+    tagging = {"Tagging": urlencode(tags)} if tags else {}
+    retries: List[int] = []  # each request's retry count
+    size = os.path.getsize(fn)
+    threshold = cfg["s3_progressive_upload"].get_int("multipart_threshold_mb", 64) * 1048576
+    try:
+        if size < threshold or size == 0:
+            with open(fn, "rb") as infile:
+                body = infile.read()
+            checksum = crc32(body)
+            limit_bandwidth(cfg, len(body))
+            rslt = s3_client.put_object(Bucket=bucket, Key=key, Body=body, ChecksumCRC32=checksum, **tagging)
+            retries.append(rslt["ResponseMetadata"].get("RetryAttempts", 0))
+        else:
+            checksum, rslt = s3put_multipart(cfg, fn, bucket, key, size, tagging, retries)
+        # S3 reports a multipart object's composite checksum with or without the -N part count
+        if rslt.get("ChecksumCRC32", checksum).split("-")[0] != checksum.split("-")[0]:
+            raise ValueError(f"checksum mismatch after upload: {rslt['ChecksumCRC32']} != {checksum}")
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError, ValueError) as exn:
+        logger.error(
+            _("failed uploading output file", file=fn, uri=s3uri, size=size, error=str(exn))
+        )
+        raise WDL.Error.RuntimeError(f"failed uploading {fn} to {s3uri}") from exn
+    finally:
+        if stats is not None:
+            stats["retries"] = stats.get("retries", 0) + sum(retries)
+    logger.debug(_("uploaded", file=fn, uri=s3uri, size=size, checksum=checksum))
+    return checksum
+
+
+def s3put_multipart(
+    cfg, fn, bucket, key, size, tagging: Dict[str, str], retries: List[int]
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    multipart upload with up to multipart_concurrency parts in flight; returns the composite
+    checksum expected for the completed object, and the CompleteMultipartUpload response. Appends
+    each request's retry count to retries.
+    """
+    part_size = multipart_part_size(cfg, size)
+    mpu = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ChecksumAlgorithm="CRC32", **tagging)
+    retries.append(mpu["ResponseMetadata"].get("RetryAttempts", 0))
+
+    def upload_part(part_number):
+        with open(fn, "rb") as infile:
+            infile.seek((part_number - 1) * part_size)
+            body = infile.read(part_size)
+        checksum = crc32(body)
+        limit_bandwidth(cfg, len(body))
+        rslt = s3_client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=mpu["UploadId"],
+            PartNumber=part_number,
+            Body=body,
+            ChecksumCRC32=checksum,
+        )
+        retries.append(rslt["ResponseMetadata"].get("RetryAttempts", 0))
+        return {"PartNumber": part_number, "ETag": rslt["ETag"], "ChecksumCRC32": checksum}
+
+    try:
+        concurrency = cfg["s3_progressive_upload"].get_int("multipart_concurrency", 4)
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            parts = list(executor.map(upload_part, range(1, (size + part_size - 1) // part_size + 1)))
+        rslt = s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=mpu["UploadId"], MultipartUpload={"Parts": parts}
+        )
+        retries.append(rslt["ResponseMetadata"].get("RetryAttempts", 0))
+    except BaseException:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=mpu["UploadId"])
+        raise
+    part_checksums = b"".join(base64.b64decode(part["ChecksumCRC32"]) for part in parts)
+    return (f"{crc32(part_checksums)}-{len(parts)}", rslt)
+
+
+def s3put_gzip(
+    cfg,
+    logger,
+    fn,
+    s3uri,
+    content_encoding: bool,
+    tags: Optional[Dict[str, str]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    gzip fn as it's read and upload the compressed stream, without staging it on disk: a single PUT
+    if it compresses into less than one part, otherwise a multipart upload of each part as soon as
+    it fills, so that memory use is bounded by the part size. Returns the (composite) CRC32 checksum
+    of the compressed object.
+    """
+    uri = urlparse(s3uri)
+    bucket, key = uri.hostname, uri.path[1:]
+    extra: Dict[str, str] = {"Tagging": urlencode(tags)} if tags else {}
+    if content_encoding:
+        extra["ContentEncoding"] = "gzip"
+    retries: List[int] = []
+    size = os.path.getsize(fn)
+    part_size = max(multipart_part_size(cfg, size), 5 * 1048576)
+    compressor = zlib.compressobj(cfg["s3_progressive_upload"].get_int("compress_level", 6), zlib.DEFLATED, 31)
+    buf = bytearray()
+    parts: List[Dict[str, Any]] = []
+    upload_id = None
+    compressed_size = 0
+
+    def upload_part(body: bytes) -> None:
+        nonlocal upload_id
+        if upload_id is None:
+            mpu = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ChecksumAlgorithm="CRC32", **extra)
+            retries.append(mpu["ResponseMetadata"].get("RetryAttempts", 0))
+            upload_id = mpu["UploadId"]
+        checksum = crc32(body)
+        limit_bandwidth(cfg, len(body))
+        rslt = s3_client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=len(parts) + 1,
+            Body=body,
+            ChecksumCRC32=checksum,
+        )
+        retries.append(rslt["ResponseMetadata"].get("RetryAttempts", 0))
+        parts.append({"PartNumber": len(parts) + 1, "ETag": rslt["ETag"], "ChecksumCRC32": checksum})
+
+    try:
+        try:
+            with open(fn, "rb") as infile:
+                for chunk in iter(lambda: infile.read(1048576), b""):
+                    buf += compressor.compress(chunk)
+                    if len(buf) >= part_size:
+                        upload_part(bytes(buf))
+                        compressed_size += len(buf)
+                        buf.clear()
+            buf += compressor.flush()
+            compressed_size += len(buf)
+            if upload_id is None:
+                checksum = crc32(bytes(buf))
+                limit_bandwidth(cfg, len(buf))
+                rslt = s3_client.put_object(Bucket=bucket, Key=key, Body=bytes(buf), ChecksumCRC32=checksum, **extra)
+                retries.append(rslt["ResponseMetadata"].get("RetryAttempts", 0))
+            else:
+                if buf:
+                    upload_part(bytes(buf))
+                rslt = s3_client.complete_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+                )
+                retries.append(rslt["ResponseMetadata"].get("RetryAttempts", 0))
+                part_checksums = b"".join(base64.b64decode(part["ChecksumCRC32"]) for part in parts)
+                checksum = f"{crc32(part_checksums)}-{len(parts)}"
+        except BaseException:
+            if upload_id is not None:
+                s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+        if rslt.get("ChecksumCRC32", checksum).split("-")[0] != checksum.split("-")[0]:
+            raise ValueError(f"checksum mismatch after upload: {rslt['ChecksumCRC32']} != {checksum}")
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError, ValueError) as exn:
+        logger.error(
+            _("failed uploading output file", file=fn, uri=s3uri, size=size, error=str(exn))
+        )
+        raise WDL.Error.RuntimeError(f"failed uploading {fn} to {s3uri}") from exn
+    finally:
+        if stats is not None:
+            stats["retries"] = stats.get("retries", 0) + sum(retries)
+            stats["compressed_bytes"] = compressed_size
+    logger.debug(
+        _("uploaded gzipped", file=fn, uri=s3uri, size=size, compressed_size=compressed_size, checksum=checksum)
+    )
+    return checksum
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Benchmark the plugin's upload path against a local S3 stand-in (moto server), so that changes to it
+can be compared objectively without AWS credentials. Drives the task() and workflow() hooks directly
+on synthetic run directories laid out as miniwdl would (no docker), one scenario per subprocess so
+that each one's peak memory is measured separately:
+
+    tiny            many small files output by one task
+    large           a few multi-GB files output by one task
+    deep_directory  a Directory output nested many levels deep
+    wide_scatter    test.wdl with a wide scatter of hello calls, then file_array_to_directory
+
+Reports wall time, throughput, S3 request counts by operation, and peak RSS. Requires moto[server]
+(pip3 install "moto[server]") alongside miniwdl & boto3. Request counts cover the plugin's boto3
+clients only, so they're meaningful with the (default here) boto3 upload backend.
+
+Example invocation from miniwdl-plugins/:
+    python3 s3upload/test/benchmark.py --scenario tiny --scenario wide_scatter \\
+        --set max_concurrent_uploads=16 --json /tmp/bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import random
+import shutil
+import resource
+import subprocess
+import tempfile
+import threading
+from collections import Counter
+from concurrent import futures
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["tiny", "large", "deep_directory", "wide_scatter"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario(s) to run (default all)")
+    parser.add_argument(
+        "--workdir", help="directory for the synthetic files, created if need be (default: a new temp dir)"
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="keep the scenarios' run directories (and the default temp workdir) instead of deleting them",
+    )
+    parser.add_argument("--port", type=int, default=5123, help="port for the moto server")
+    parser.add_argument("--tiny-count", type=int, default=2000, help="number of files in tiny")
+    parser.add_argument("--tiny-bytes", type=int, default=1024, help="size of each file in tiny")
+    parser.add_argument("--large-count", type=int, default=2, help="number of files in large")
+    parser.add_argument("--large-mb", type=int, default=2048, help="size of each file in large (MiB)")
+    parser.add_argument("--depth", type=int, default=8, help="nesting depth in deep_directory")
+    parser.add_argument("--fanout", type=int, default=3, help="subdirectories per level in deep_directory")
+    parser.add_argument("--width", type=int, default=500, help="scatter width in wide_scatter")
+    parser.add_argument("--task-concurrency", type=int, default=32, help="concurrent task hooks in wide_scatter")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="[s3_progressive_upload] option for the plugin (repeatable), e.g. async_uploads=true",
+    )
+    parser.add_argument(
+        "--slowdown-rate",
+        type=float,
+        default=0.0,
+        help="fraction of S3 requests to fail with 503 SlowDown, to exercise throttling & retries",
+    )
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)  # internal: run one scenario in this process
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args, args.workdir)))
+        return
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="miniwdl_s3upload_benchmark.")
+
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # the server's request log
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=args.port, verbose=False)
+    server.start()
+    try:
+        results = []
+        for scenario in args.scenario or SCENARIOS:
+            cmd = [sys.executable, __file__] + sys.argv[1:] + ["--workdir", workdir, "--run-scenario", scenario]
+            try:
+                proc = subprocess.run(
+                    cmd, stdout=subprocess.PIPE, env=dict(os.environ, **s3_env(args.port)), check=True
+                )
+            finally:
+                if not args.keep:
+                    # the run directory; synthetic large files stay in --workdir for reuse
+                    for run_dir in os.listdir(workdir):
+                        if run_dir.startswith(scenario + "."):
+                            shutil.rmtree(os.path.join(workdir, run_dir), ignore_errors=True)
+            result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+            print(report(result), file=sys.stderr)
+            results.append(result)
+    finally:
+        server.stop()
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+def s3_env(port):
+    return {
+        "AWS_ENDPOINT_URL": f"http://127.0.0.1:{port}",
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+
+
+def report(result):
+    lines = [
+        f"{result['scenario']}: {result['files']} files, {result['bytes'] / 1048576:.1f} MiB in"
+        f" {result['seconds']:.2f}s = {result['mib_per_s']:.1f} MiB/s, {result['files_per_s']:.1f} files/s,"
+        f" peak RSS {result['peak_rss_mib']:.0f} MiB",
+        "    requests: " + ", ".join(f"{op} {n}" for (op, n) in sorted(result["requests"].items())),
+    ]
+    return "\n".join(lines)
+
+
+def run_scenario(args, workdir):
+    # import the plugin only now, with AWS_ENDPOINT_URL pointing its module-level clients at the stand-in
+    sys.path.insert(0, os.path.dirname(HERE))
+    import WDL
+    from WDL.runtime import config
+    import botocore.awsrequest
+    import miniwdl_s3upload
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("benchmark")
+    scenario = args.run_scenario
+    bucket = "miniwdl-s3upload-benchmark"
+    try:
+        miniwdl_s3upload.s3_client.create_bucket(Bucket=bucket)
+    except miniwdl_s3upload.s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    options = {
+        "uri_prefix": f"s3://{bucket}/{scenario}-{int(time.time() * 1000)}",
+        "upload_backend": "boto3",
+    }
+    for kv in args.set:
+        key, value = kv.split("=", 1)
+        options[key] = value
+    cfg = config.Loader(logger)
+    cfg.override({"s3_progressive_upload": options})
+
+    requests = Counter()
+
+    def count_request(model, **kwargs):
+        requests[model.name] += 1
+
+    def inject_slowdown(request, **kwargs):
+        # answer without sending, as S3 does when a prefix exceeds its request rate
+        if random.random() < args.slowdown_rate:
+            requests["(SlowDown)"] += 1
+            return botocore.awsrequest.AWSResponse(request.url, 503, {}, SlowDownBody())
+        return None
+
+    for client in (miniwdl_s3upload.s3_client, miniwdl_s3upload.s3.meta.client):
+        client.meta.events.register("before-call.s3", count_request)
+        if args.slowdown_rate:
+            client.meta.events.register("before-send.s3", inject_slowdown)
+
+    run_dir = tempfile.mkdtemp(prefix=f"{scenario}.", dir=workdir)
+    if scenario == "wide_scatter":
+        files, nbytes, tasks, workflow, outputs = setup_wide_scatter(args, workdir, run_dir)
+    else:
+        files, nbytes, tasks, workflow, outputs = setup_single_task(args, scenario, workdir, run_dir)
+
+    t0 = time.time()
+    run_id = [os.path.basename(run_dir)]
+    wf_hook = miniwdl_s3upload.workflow(cfg, logger, run_id, run_dir, workflow, inputs=WDL.Env.Bindings())
+    wf_hook.send(None)
+    with futures.ThreadPoolExecutor(max_workers=args.task_concurrency) as executor:
+        for fut in [
+            executor.submit(run_task_hook, miniwdl_s3upload, cfg, logger, run_id + [call_id], task_dir)
+            for (call_id, task_dir) in tasks
+        ]:
+            fut.result()
+    wf_hook.send({"outputs": outputs})
+    seconds = time.time() - t0
+
+    peak_rss = peak_rss_bytes()
+    return {
+        "scenario": scenario,
+        "options": options,
+        "files": files,
+        "bytes": nbytes,
+        "seconds": seconds,
+        "mib_per_s": nbytes / 1048576 / max(seconds, 0.001),
+        "files_per_s": files / max(seconds, 0.001),
+        "requests": dict(requests),
+        "peak_rss_mib": peak_rss / 1048576,
+        "threads": threading.active_count(),
+    }
+
+
+def peak_rss_bytes():
+    # VmHWM rather than ru_maxrss, which Linux carries over from the parent (moto server) across exec
+    try:
+        with open("/proc/self/status") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class SlowDownBody:
+    # raw body of the injected 503 response
+    def stream(self, **kwargs):
+        yield b"<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>"
+
+
+def run_task_hook(miniwdl_s3upload, cfg, logger, run_id, run_dir):
+    # drive the generator as miniwdl does: inputs, then container, then outputs
+    hook = miniwdl_s3upload.task(cfg, logger, run_id, run_dir, None, inputs=None)
+    recv = hook.send(None)
+    recv = hook.send(recv)
+    hook.send(dict(recv, outputs=None))
+
+
+def synthetic_file(path, size, pattern=None):
+    """
+    create a file of the given size with incompressible contents; large ones are generated once and
+    then reused by later runs with the same --workdir, via hard link
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if pattern and os.path.isfile(pattern) and os.path.getsize(pattern) == size:
+        os.link(pattern, path)
+        return
+    with open(path, "wb") as outfile:
+        remaining = size
+        while remaining:
+            chunk = os.urandom(min(remaining, 16777216))
+            outfile.write(chunk)
+            remaining -= len(chunk)
+    if pattern:
+        os.link(path, pattern)
+
+
+def output_link(run_dir, output, target):
+    # out/<output>/<basename>, symlinked to the file or directory under work/, as miniwdl does
+    dn = os.path.join(run_dir, "out", output)
+    os.makedirs(dn, exist_ok=True)
+    link = os.path.join(dn, os.path.basename(target))
+    os.symlink(target, link)
+    return link
+
+
+def setup_single_task(args, scenario, workdir, run_dir):
+    import WDL
+
+    task_dir = os.path.join(run_dir, "call-bench")
+    work = os.path.join(task_dir, "work")
+    if scenario == "tiny":
+        dn = os.path.join(task_dir, "out", "files")
+        for i in range(args.tiny_count):
+            fn = os.path.join(work, f"tiny{i:06d}.dat")
+            synthetic_file(fn, args.tiny_bytes)
+            os.makedirs(os.path.join(dn, str(i)))
+            os.symlink(fn, os.path.join(dn, str(i), os.path.basename(fn)))
+        files, nbytes = args.tiny_count, args.tiny_count * args.tiny_bytes
+    elif scenario == "large":
+        for i in range(args.large_count):
+            fn = os.path.join(work, f"large{i}.dat")
+            synthetic_file(fn, args.large_mb * 1048576, os.path.join(workdir, f"large{i}.{args.large_mb}M.dat"))
+            output_link(task_dir, f"large{i}", fn)
+        files, nbytes = args.large_count, args.large_count * args.large_mb * 1048576
+    else:
+        assert scenario == "deep_directory"
+        root = os.path.join(work, "tree")
+        files = 0
+
+        def populate(dn, level):
+            nonlocal files
+            for i in range(args.fanout):
+                synthetic_file(os.path.join(dn, f"f{i}.dat"), args.tiny_bytes)
+                files += 1
+            if level < args.depth:
+                for i in range(args.fanout):
+                    populate(os.path.join(dn, f"d{i}"), level + 1)
+
+        populate(root, 1)
+        output_link(task_dir, "tree", root)
+        nbytes = files * args.tiny_bytes
+    # a workflow with no outputs, so this exercises the task uploads only
+    doc = WDL.parse_document("version development\nworkflow bench {\n}\n")
+    doc.typecheck()
+    return files, nbytes, [("call-bench", task_dir)], doc.workflow, WDL.Env.Bindings()
+
+
+def setup_wide_scatter(args, workdir, run_dir):
+    import WDL
+
+    doc = WDL.load(os.path.join(HERE, "test.wdl"))
+    tasks = []
+    messages = []
+    for i in range(args.width):
+        task_dir = os.path.join(run_dir, f"call-hello-{i}")
+        fn = os.path.join(task_dir, "work", f"name{i}.txt")
+        os.makedirs(os.path.dirname(fn))
+        with open(fn, "w") as outfile:
+            print(f"Hello, name{i}!", file=outfile)
+        messages.append(output_link(task_dir, "message", fn))
+        tasks.append((f"call-hello-{i}", task_dir))
+    task_dir = os.path.join(run_dir, "call-file_array_to_directory")
+    dn = os.path.join(task_dir, "work", "messages")
+    os.makedirs(dn)
+    for fn in messages:
+        os.link(os.path.realpath(fn), os.path.join(dn, os.path.basename(fn)))
+    directory = output_link(task_dir, "directory", dn)
+    tasks.append(("call-file_array_to_directory", task_dir))
+    outputs = WDL.values_from_json(
+        {
+            "message0": messages[0],
+            "messages_array": messages,
+            "messages_directory": directory,
+        },
+        doc.workflow.effective_outputs,
+    )
+    nbytes = 2 * sum(os.path.getsize(fn) for fn in messages)
+    return 2 * len(messages), nbytes, tasks, doc.workflow, outputs
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Retry & adaptive concurrency tests, injecting S3 errors through botocore's Stubber (no AWS access
+needed):
+
+    python3 -m unittest discover -s s3upload/test
+"""
+import os
+import sys
+import logging
+import tempfile
+import unittest
+import unittest.mock
+
+import boto3
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import miniwdl_s3upload  # noqa: E402
+from WDL.runtime import config  # noqa: E402
+import WDL  # noqa: E402
+
+
+class TestRetries(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(self.id())
+        self.cfg = config.Loader(self.logger)
+        self.cfg.override({"s3_progressive_upload": {"upload_backend": "boto3", "max_concurrent_uploads": 8}})
+        client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="x", aws_secret_access_key="x")
+        self.stubber = Stubber(client)
+        self.stubber.activate()
+        for (target, value) in [
+            ("miniwdl_s3upload.s3_client", client),
+            ("miniwdl_s3upload._upload_limiters", {}),
+            ("time.sleep", lambda _seconds: None),  # skip the backoff delays
+        ]:
+            patcher = unittest.mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        fd, self.fn = tempfile.mkstemp(prefix="miniwdl_s3upload_test_")
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(b"hello\n")
+        self.addCleanup(os.unlink, self.fn)
+        self.checksum = miniwdl_s3upload.crc32(b"hello\n")
+
+    def slow_down(self, times):
+        for _ in range(times):
+            self.stubber.add_client_error(
+                "put_object", service_error_code="SlowDown", service_message="Please reduce your request rate.",
+                http_status_code=503,
+            )
+
+    def put_ok(self):
+        self.stubber.add_response(
+            "put_object",
+            {"ETag": '"etag"', "ChecksumCRC32": self.checksum, "ResponseMetadata": {"RetryAttempts": 0}},
+        )
+
+    def upload(self):
+        stats = {}
+        checksum = miniwdl_s3upload.scheduled_s3cp(self.cfg, self.logger, self.fn, "s3://bkt/run/f.txt", {}, stats)
+        return checksum, stats
+
+    def test_retry_slowdown(self):
+        self.slow_down(2)
+        self.put_ok()
+        self.assertEqual(self.upload(), (self.checksum, {"retries": 2}))
+        self.stubber.assert_no_pending_responses()
+        # halved for each 503, and not yet recovered after one success
+        self.assertEqual(miniwdl_s3upload.upload_limiter(self.cfg, "s3://bkt/run/f.txt").limit, 2)
+
+    def test_give_up(self):
+        self.cfg.override({"s3_progressive_upload": {"max_upload_attempts": 3}})
+        self.slow_down(3)
+        with self.assertRaises(WDL.Error.RuntimeError):
+            self.upload()
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(miniwdl_s3upload.upload_limiter(self.cfg, "s3://bkt/run/f.txt").limit, 1)
+
+    def test_no_retry(self):
+        self.stubber.add_client_error("put_object", service_error_code="AccessDenied", http_status_code=403)
+        self.put_ok()
+        with self.assertRaises(WDL.Error.RuntimeError):
+            self.upload()
+        # not retried, nor throttling
+        self.assertEqual(len(self.stubber._queue), 1)
+        self.assertEqual(miniwdl_s3upload.upload_limiter(self.cfg, "s3://bkt/run/f.txt").limit, 8)
+
+    def test_aimd(self):
+        limiter = miniwdl_s3upload.AdaptiveLimiter(8)
+        for expected in (4, 2, 1, 1):
+            limiter.acquire()
+            limiter.release(throttled=True)
+            self.assertEqual(limiter.limit, expected)
+        # recovers by one after each limit's worth of unthrottled uploads
+        for expected in (2, 2, 3, 3, 3, 4):
+            limiter.acquire()
+            limiter.release(throttled=False)
+            self.assertEqual(limiter.limit, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()